@@ -0,0 +1,213 @@
+"""
+Asynchronous access logging for the API Gateway
+Each request leaves one small record in an in-memory ring buffer; a
+background task formats and writes the records in batches off the event loop
+"""
+
+import asyncio
+import json
+import logging
+import random
+import sys
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Dict, List, Optional, TextIO
+
+logger = logging.getLogger(__name__)
+
+
+class RingBuffer:
+    """
+    Fixed-size buffer of log records
+
+    Only ever touched from the event loop, so appends need no lock. When the
+    writer falls behind, the oldest records are overwritten and counted.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.slots: List[Optional[tuple]] = [None] * capacity
+        self.head = 0  # next slot to read
+        self.size = 0
+        self.dropped = 0
+
+    def append(self, record: tuple):
+        tail = (self.head + self.size) % self.capacity
+        self.slots[tail] = record
+        if self.size == self.capacity:
+            self.head = (self.head + 1) % self.capacity
+            self.dropped += 1
+        else:
+            self.size += 1
+
+    def drain(self, limit: int) -> List[tuple]:
+        count = min(limit, self.size)
+        records = []
+        for _ in range(count):
+            records.append(self.slots[self.head])
+            self.slots[self.head] = None
+            self.head = (self.head + 1) % self.capacity
+        self.size -= count
+        return records
+
+
+class AccessLog:
+    """
+    Sampled, buffered access log
+
+    Successful requests are kept with the sampling rate of their status
+    class; server errors and requests slower than slow_seconds are always
+    kept. Records are written as JSON lines every flush_interval seconds.
+    Requests rejected under overload are only counted, and logged as one
+    summary line per flush.
+    """
+
+    def __init__(
+        self,
+        capacity: int,
+        flush_interval: float,
+        batch_size: int,
+        sample_rates: Dict[int, float],
+        slow_seconds: float,
+        stream: TextIO = sys.stdout
+    ):
+        self.buffer = RingBuffer(capacity)
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.sample_rates = sample_rates
+        self.slow_seconds = slow_seconds
+        self.stream = stream
+        self.flusher: Optional[asyncio.Task] = None
+        self.logged = 0
+        self.sampled_out = 0
+        self.written = 0
+        self.rejections: Counter = Counter()
+
+    def record(
+        self,
+        method: str,
+        path: str,
+        status: int,
+        duration: float,
+        sent_bytes: int,
+        client: Optional[str]
+    ):
+        if status < 500 and duration < self.slow_seconds:
+            rate = self.sample_rates.get(status // 100, 1.0)
+            if rate < 1.0 and random.random() >= rate:
+                self.sampled_out += 1
+                return
+        self.logged += 1
+        self.buffer.append((time.time(), method, path, status, duration, sent_bytes, client))
+
+    def count_rejection(self, kind: str, target: str):
+        self.rejections[(kind, target)] += 1
+
+    def summarize_rejections(self):
+        if not self.rejections:
+            return
+        counts = ", ".join(
+            f"{kind} {target}: {count}" for (kind, target), count in sorted(self.rejections.items())
+        )
+        self.rejections.clear()
+        logger.warning("Rejected in the last %ss: %s", self.flush_interval, counts)
+
+    def format(self, records: List[tuple]) -> str:
+        lines = []
+        for timestamp, method, path, status, duration, sent_bytes, client in records:
+            lines.append(json.dumps({
+                "time": datetime.fromtimestamp(timestamp).isoformat(),
+                "method": method,
+                "path": path,
+                "status": status,
+                "duration_ms": round(duration * 1000, 3),
+                "bytes": sent_bytes,
+                "client": client,
+                "slow": duration >= self.slow_seconds,
+            }))
+        return "\n".join(lines) + "\n"
+
+    def write(self, records: List[tuple]):
+        self.stream.write(self.format(records))
+        self.stream.flush()
+
+    async def flush(self):
+        loop = asyncio.get_running_loop()
+        while self.buffer.size:
+            records = self.buffer.drain(self.batch_size)
+            await loop.run_in_executor(None, self.write, records)
+            self.written += len(records)
+
+    async def flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            self.summarize_rejections()
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Access log flush failed")
+
+    def start(self):
+        if self.flusher is None:
+            self.flusher = asyncio.ensure_future(self.flush_loop())
+
+    async def stop(self):
+        if self.flusher is not None:
+            self.flusher.cancel()
+            try:
+                await self.flusher
+            except asyncio.CancelledError:
+                pass
+            self.flusher = None
+        self.summarize_rejections()
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "logged": self.logged,
+            "sampled_out": self.sampled_out,
+            "written": self.written,
+            "buffered": self.buffer.size,
+            "dropped": self.buffer.dropped,
+            "sample_rates": {f"{k}xx": v for k, v in self.sample_rates.items()},
+            "slow_ms": round(self.slow_seconds * 1000, 3),
+        }
+
+
+class AccessLogMiddleware:
+    """ASGI middleware recording status, bytes sent and duration per request"""
+
+    def __init__(self, app, access_log: AccessLog):
+        self.app = app
+        self.access_log = access_log
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = 500
+        sent_bytes = 0
+
+        async def send_wrapper(message):
+            nonlocal status, sent_bytes
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                sent_bytes += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            client = scope.get("client")
+            self.access_log.record(
+                scope["method"],
+                scope["path"],
+                status,
+                time.perf_counter() - started,
+                sent_bytes,
+                client[0] if client else None
+            )
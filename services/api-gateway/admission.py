@@ -0,0 +1,234 @@
+"""
+Adaptive admission control for the API Gateway
+Each route class has a concurrency limit that adapts to observed upstream
+latency; requests over the limit wait in a short priority queue and
+are shed when it is full or the wait runs out
+"""
+
+import asyncio
+import time
+from collections import deque
+from typing import List, Optional
+
+from pools import env_float, env_int
+
+
+class Overloaded(Exception):
+    """Raised when a request is shed by admission control"""
+
+    def __init__(self, route_class: str, status_code: int, retry_after: int, reason: str):
+        super().__init__(f"{route_class} overloaded: {reason}")
+        self.route_class = route_class
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class AdaptiveLimit:
+    """
+    Gradient concurrency limit
+
+    Latency is tracked as two moving averages: a short-term one over about
+    short_window samples and a long-term baseline over about long_window
+    samples. While the short-term average stays within tolerance x the
+    baseline the upstream is considered healthy, so ordinary jitter does not
+    move the limit; once it rises above that, the limit is scaled down by
+    the ratio (at most once per round trip, and by at most half). A failure
+    cuts the limit by backoff. Otherwise the limit grows by about one per
+    limit's worth of samples while it is actually being used.
+    """
+
+    def __init__(
+        self,
+        initial: int,
+        min_limit: int,
+        max_limit: int,
+        tolerance: float = 1.5,
+        backoff: float = 0.9,
+        short_window: int = 20,
+        long_window: int = 500
+    ):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.tolerance = tolerance
+        self.backoff = backoff
+        self.short_window = short_window
+        self.long_window = long_window
+        self.samples = 0
+        self.short_rtt: Optional[float] = None
+        self.baseline: Optional[float] = None
+        self.last_decrease = 0.0
+
+    def update(self, rtt: float, failed: bool, in_flight: int):
+        now = time.monotonic()
+        if failed:
+            if now - self.last_decrease >= (self.short_rtt or rtt):
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+                self.last_decrease = now
+            return
+
+        # Plain means until each window has filled, so the first samples
+        # do not set the baseline on their own
+        self.samples += 1
+        if self.short_rtt is None:
+            self.short_rtt = self.baseline = rtt
+        else:
+            self.short_rtt += (rtt - self.short_rtt) / min(self.samples, self.short_window)
+            self.baseline += (rtt - self.baseline) / min(self.samples, self.long_window)
+        # After a slow spell, let the baseline come back down with the upstream
+        if self.baseline > 2 * self.short_rtt:
+            self.baseline = max(self.short_rtt, self.baseline * 0.95)
+
+        gradient = max(0.5, min(1.0, self.tolerance * self.baseline / self.short_rtt))
+        if gradient < 1.0:
+            if now - self.last_decrease >= self.short_rtt:
+                self.limit = max(self.min_limit, self.limit * gradient)
+                self.last_decrease = now
+        elif in_flight * 2 >= self.limit:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+
+class RouteClass:
+    """A group of routes sharing one adaptive limit and one wait queue"""
+
+    def __init__(
+        self,
+        name: str,
+        priority: int,
+        prefixes: List[str],
+        share: float,
+        max_queue: int,
+        queue_timeout: float
+    ):
+        key = name.upper()
+        self.name = name
+        self.priority = priority
+        self.prefixes = prefixes
+        self.share = share
+        self.max_queue = env_int(f"{key}_MAX_QUEUE", max_queue)
+        self.queue_timeout = env_float(f"{key}_QUEUE_TIMEOUT", queue_timeout)
+        self.limiter = AdaptiveLimit(
+            initial=env_int(f"{key}_CONCURRENCY_INITIAL", 50),
+            min_limit=env_int(f"{key}_CONCURRENCY_MIN", 5),
+            max_limit=env_int(f"{key}_CONCURRENCY_MAX", 500),
+        )
+        self.in_flight = 0
+        self.queue: deque = deque()
+        self.admitted = 0
+        self.queued = 0
+        self.shed_queue_full = 0
+        self.shed_timeout = 0
+
+    def matches(self, path: str) -> bool:
+        return any(path == prefix or path.startswith(prefix + "/") for prefix in self.prefixes)
+
+    def snapshot(self) -> dict:
+        baseline = self.limiter.baseline
+        short_rtt = self.limiter.short_rtt
+        return {
+            "priority": self.priority,
+            "limit": round(self.limiter.limit, 2),
+            "in_flight": self.in_flight,
+            "queue_depth": len(self.queue),
+            "max_queue": self.max_queue,
+            "latency_baseline_ms": round(baseline * 1000, 3) if baseline is not None else None,
+            "latency_recent_ms": round(short_rtt * 1000, 3) if short_rtt is not None else None,
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "shed_queue_full": self.shed_queue_full,
+            "shed_timeout": self.shed_timeout,
+        }
+
+
+class AdmissionController:
+    """
+    Admits upstream calls per route class
+
+    Besides its own adaptive limit, each class may only occupy its share of
+    the gateway-wide concurrency limit, and queued requests are admitted in
+    priority order, so checkout keeps capacity while browsing is shed.
+    """
+
+    def __init__(self, global_limit: int):
+        self.global_limit = global_limit
+        self.in_flight = 0
+        self.classes: List[RouteClass] = []
+
+    def add_class(self, route_class: RouteClass):
+        self.classes.append(route_class)
+        self.classes.sort(key=lambda c: c.priority)
+
+    def classify(self, path: str) -> Optional[RouteClass]:
+        for route_class in self.classes:
+            if route_class.matches(path):
+                return route_class
+        return None
+
+    def has_capacity(self, route_class: RouteClass) -> bool:
+        return (
+            route_class.in_flight < int(route_class.limiter.limit)
+            and self.in_flight < self.global_limit * route_class.share
+        )
+
+    def admit(self, route_class: RouteClass):
+        route_class.in_flight += 1
+        route_class.admitted += 1
+        self.in_flight += 1
+
+    async def acquire(self, route_class: RouteClass):
+        """Wait for a slot or raise Overloaded"""
+        higher_waiting = any(
+            c.queue for c in self.classes if c.priority <= route_class.priority
+        )
+        if not higher_waiting and self.has_capacity(route_class):
+            self.admit(route_class)
+            return
+
+        if len(route_class.queue) >= route_class.max_queue:
+            route_class.shed_queue_full += 1
+            raise Overloaded(route_class.name, 429, 1, "queue full")
+
+        waiter = asyncio.get_running_loop().create_future()
+        route_class.queue.append(waiter)
+        route_class.queued += 1
+        try:
+            await asyncio.wait_for(waiter, route_class.queue_timeout)
+        except asyncio.TimeoutError:
+            self.dequeue(route_class, waiter)
+            route_class.shed_timeout += 1
+            raise Overloaded(route_class.name, 503, 1, "queue timeout")
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Admitted just as the caller went away; hand the slot back
+                self.release(route_class, None, False)
+            else:
+                self.dequeue(route_class, waiter)
+            raise
+
+    def dequeue(self, route_class: RouteClass, waiter: asyncio.Future):
+        if waiter in route_class.queue:
+            route_class.queue.remove(waiter)
+
+    def release(self, route_class: RouteClass, rtt: Optional[float], failed: bool):
+        """Return a slot, feed the latency sample and admit queued requests"""
+        if rtt is not None:
+            route_class.limiter.update(rtt, failed, route_class.in_flight)
+        route_class.in_flight -= 1
+        self.in_flight -= 1
+        self.dispatch()
+
+    def dispatch(self):
+        for route_class in self.classes:
+            while route_class.queue and self.has_capacity(route_class):
+                waiter = route_class.queue.popleft()
+                if not waiter.done():
+                    self.admit(route_class)
+                    waiter.set_result(None)
+
+    def stats(self) -> dict:
+        return {
+            "global_limit": self.global_limit,
+            "in_flight": self.in_flight,
+            "classes": {c.name: c.snapshot() for c in self.classes},
+        }
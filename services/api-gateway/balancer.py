@@ -0,0 +1,227 @@
+"""
+Client-side load balancing for the API Gateway
+Requests to an upstream are spread over its replicas per request rather than
+per connection, choosing the less busy of two random healthy replicas
+"""
+
+import asyncio
+import random
+import socket
+import time
+from typing import Dict, Optional
+
+import httpx
+
+# Upstream statuses that count against a replica's health
+UNHEALTHY_STATUSES = frozenset({502, 503, 504})
+
+
+class Endpoint:
+    """One upstream replica with its outstanding requests and passive health"""
+
+    def __init__(self, scheme: str, host: str, port: int):
+        self.scheme = scheme
+        self.host = host
+        self.port = port
+        self.outstanding = 0
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+        self.times_ejected = 0
+
+    @property
+    def address(self) -> str:
+        host = f"[{self.host}]" if ":" in self.host else self.host
+        return f"{self.scheme}://{host}:{self.port}"
+
+    def healthy(self, now: float) -> bool:
+        return now >= self.ejected_until
+
+    def snapshot(self, now: float) -> dict:
+        return {
+            "address": self.address,
+            "healthy": self.healthy(now),
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "failures": self.failures,
+            "times_ejected": self.times_ejected,
+        }
+
+
+class EndpointSet:
+    """
+    Replicas of one upstream and the policy for choosing between them
+
+    Replicas are either an explicit list of base URLs or, when dns_name
+    names a host such as a headless Service, its A/AAAA records re-resolved
+    every dns_refresh seconds; with neither, the upstream URL itself is the
+    only replica. A replica failing eject_after calls in a row is taken out
+    of rotation for eject_seconds.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        endpoints: Optional[str] = None,
+        dns_name: Optional[str] = None,
+        dns_refresh: float = 10.0,
+        eject_after: int = 5,
+        eject_seconds: float = 10.0
+    ):
+        base = httpx.URL(base_url)
+        self.scheme = base.scheme
+        self.port = base.port or (443 if base.scheme == "https" else 80)
+        self.dns_name = dns_name
+        self.dns_refresh = dns_refresh
+        self.eject_after = eject_after
+        self.eject_seconds = eject_seconds
+        self.resolve_failures = 0
+        self.refresher: Optional[asyncio.Task] = None
+
+        if endpoints:
+            urls = [httpx.URL(url.strip()) for url in endpoints.split(",") if url.strip()]
+            self.endpoints = [
+                Endpoint(url.scheme, url.host, url.port or self.port) for url in urls
+            ]
+        else:
+            self.endpoints = [Endpoint(self.scheme, base.host, self.port)]
+
+    def choose(self, exclude: Optional[Endpoint] = None) -> Endpoint:
+        """
+        Power of two choices over healthy replicas by outstanding requests,
+        avoiding `exclude` (the replica a hedged request is already waiting
+        on) unless it is the only one
+        """
+        now = time.monotonic()
+        others = [e for e in self.endpoints if e is not exclude] or self.endpoints
+        candidates = [e for e in others if e.healthy(now)]
+        if not candidates:
+            # Everything is ejected; spreading load beats refusing it
+            candidates = others
+        if len(candidates) == 1:
+            return candidates[0]
+        first, second = random.sample(candidates, 2)
+        return first if first.outstanding <= second.outstanding else second
+
+    def record(self, endpoint: Endpoint, failed: bool):
+        if not failed:
+            endpoint.consecutive_failures = 0
+            return
+        endpoint.failures += 1
+        endpoint.consecutive_failures += 1
+        now = time.monotonic()
+        if endpoint.consecutive_failures >= self.eject_after and endpoint.healthy(now):
+            endpoint.consecutive_failures = 0
+            endpoint.ejected_until = now + self.eject_seconds
+            endpoint.times_ejected += 1
+
+    async def resolve(self):
+        """Replace the replica list with the current DNS records for dns_name"""
+        loop = asyncio.get_running_loop()
+        try:
+            records = await loop.getaddrinfo(self.dns_name, self.port, type=socket.SOCK_STREAM)
+        except OSError:
+            # Keep serving the last known replicas
+            self.resolve_failures += 1
+            return
+        addresses = sorted({record[4][0] for record in records})
+        if not addresses:
+            return
+        known: Dict[str, Endpoint] = {e.host: e for e in self.endpoints}
+        self.endpoints = [
+            known.get(address) or Endpoint(self.scheme, address, self.port)
+            for address in addresses
+        ]
+
+    async def refresh_loop(self):
+        while True:
+            await self.resolve()
+            await asyncio.sleep(self.dns_refresh)
+
+    def start(self):
+        if self.dns_name and self.refresher is None:
+            self.refresher = asyncio.ensure_future(self.refresh_loop())
+
+    async def stop(self):
+        if self.refresher is not None:
+            self.refresher.cancel()
+            try:
+                await self.refresher
+            except asyncio.CancelledError:
+                pass
+            self.refresher = None
+
+    def snapshot(self) -> dict:
+        now = time.monotonic()
+        return {
+            "dns_name": self.dns_name,
+            "resolve_failures": self.resolve_failures,
+            "endpoints": [e.snapshot(now) for e in self.endpoints],
+        }
+
+
+class EndpointStream(httpx.AsyncByteStream):
+    """Response stream that stops counting as outstanding once closed"""
+
+    def __init__(self, stream: httpx.AsyncByteStream, endpoint: Endpoint):
+        self.stream = stream
+        self.endpoint = endpoint
+        self.closed = False
+
+    async def __aiter__(self):
+        async for chunk in self.stream:
+            yield chunk
+
+    async def aclose(self):
+        if not self.closed:
+            self.closed = True
+            self.endpoint.outstanding -= 1
+        await self.stream.aclose()
+
+
+class BalancingTransport(httpx.AsyncBaseTransport):
+    """
+    Transport wrapper that sends each request to a replica chosen by the
+    endpoint set; the Host header keeps the upstream's logical name
+
+    A request may carry a "routing" extension dict: the chosen replica is
+    recorded in it under "endpoint", and one under "exclude" is avoided.
+    """
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, endpoints: EndpointSet):
+        self.transport = transport
+        self.endpoints = endpoints
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        routing = request.extensions.get("routing")
+        endpoint = self.endpoints.choose(routing.get("exclude") if routing is not None else None)
+        if routing is not None:
+            routing["endpoint"] = endpoint
+        request.url = request.url.copy_with(
+            scheme=endpoint.scheme, host=endpoint.host, port=endpoint.port
+        )
+        endpoint.requests += 1
+        endpoint.outstanding += 1
+        try:
+            response = await self.transport.handle_async_request(request)
+        except asyncio.CancelledError:
+            endpoint.outstanding -= 1
+            raise
+        except BaseException as e:
+            endpoint.outstanding -= 1
+            # Waiting for a free gateway connection says nothing about the replica
+            if not isinstance(e, httpx.PoolTimeout):
+                self.endpoints.record(endpoint, failed=isinstance(e, httpx.TransportError))
+            raise
+
+        self.endpoints.record(endpoint, failed=response.status_code in UNHEALTHY_STATUSES)
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=EndpointStream(response.stream, endpoint),
+            extensions=response.extensions,
+        )
+
+    async def aclose(self):
+        await self.transport.aclose()
@@ -0,0 +1,153 @@
+"""
+Circuit breakers for the API Gateway
+Each upstream gets a breaker driven by its rolling error rate and latency, so
+a failing service is answered with fast 503s instead of tying up the gateway
+"""
+
+import time
+
+from pools import env_float, env_int
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream whose circuit is open"""
+
+    def __init__(self, name: str, retry_after: int):
+        super().__init__(f"Circuit open for {name}")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class RollingWindow:
+    """Per-second buckets of call outcomes over the last window seconds"""
+
+    def __init__(self, seconds: int):
+        self.seconds = seconds
+        self.buckets = [[0, 0, 0, 0] for _ in range(seconds)]  # [second, calls, failures, slow]
+
+    def record(self, failed: bool, slow: bool):
+        now = int(time.monotonic())
+        bucket = self.buckets[now % self.seconds]
+        if bucket[0] != now:
+            bucket[:] = [now, 0, 0, 0]
+        bucket[1] += 1
+        bucket[2] += failed
+        bucket[3] += slow
+
+    def totals(self):
+        oldest = int(time.monotonic()) - self.seconds
+        calls = failures = slow = 0
+        for second, bucket_calls, bucket_failures, bucket_slow in self.buckets:
+            if second > oldest:
+                calls += bucket_calls
+                failures += bucket_failures
+                slow += bucket_slow
+        return calls, failures, slow
+
+    def reset(self):
+        for bucket in self.buckets:
+            bucket[:] = [0, 0, 0, 0]
+
+
+class CircuitBreaker:
+    """
+    Closed / open / half-open circuit breaker for one upstream
+
+    The circuit opens when, over the rolling window and with at least
+    min_calls calls, the failure rate or the slow-call rate reaches its
+    threshold. After open_seconds a limited number of probe calls are let
+    through; the circuit closes if they all succeed and reopens otherwise.
+    Settings are read from <NAME>_BREAKER_* environment variables.
+    """
+
+    def __init__(self, name: str, slow_call_seconds: float = 5.0):
+        self.name = name
+        self.failure_rate_threshold = env_float(f"{name}_BREAKER_FAILURE_RATE", 0.5)
+        self.slow_call_rate_threshold = env_float(f"{name}_BREAKER_SLOW_CALL_RATE", 0.8)
+        self.slow_call_seconds = env_float(f"{name}_BREAKER_SLOW_CALL_SECONDS", slow_call_seconds)
+        self.min_calls = env_int(f"{name}_BREAKER_MIN_CALLS", 20)
+        self.open_seconds = env_float(f"{name}_BREAKER_OPEN_SECONDS", 15.0)
+        self.half_open_calls = env_int(f"{name}_BREAKER_HALF_OPEN_CALLS", 5)
+        self.window = RollingWindow(env_int(f"{name}_BREAKER_WINDOW", 10))
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.probes_started = 0
+        self.probes_succeeded = 0
+        self.rejected = 0
+        self.times_opened = 0
+
+    def allow(self):
+        """Admit a call or raise CircuitOpenError"""
+        if self.state == OPEN:
+            if time.monotonic() - self.opened_at < self.open_seconds:
+                self.rejected += 1
+                raise CircuitOpenError(self.name, self.retry_after())
+            self.state = HALF_OPEN
+            self.probes_started = 0
+            self.probes_succeeded = 0
+        if self.state == HALF_OPEN:
+            if self.probes_started >= self.half_open_calls:
+                self.rejected += 1
+                raise CircuitOpenError(self.name, self.retry_after())
+            self.probes_started += 1
+
+    def record(self, duration: float, failed: bool):
+        """Record the outcome of an admitted call"""
+        slow = duration >= self.slow_call_seconds
+        if self.state == HALF_OPEN:
+            if failed or slow:
+                self.trip()
+                return
+            self.probes_succeeded += 1
+            if self.probes_succeeded >= self.half_open_calls:
+                self.state = CLOSED
+                self.window.reset()
+            return
+
+        self.window.record(failed, slow)
+        calls, failures, slow_calls = self.window.totals()
+        if calls >= self.min_calls and (
+            failures / calls >= self.failure_rate_threshold
+            or slow_calls / calls >= self.slow_call_rate_threshold
+        ):
+            self.trip()
+
+    def release(self):
+        """Give back a half-open probe slot for a call that never completed"""
+        if self.state == HALF_OPEN and self.probes_started > 0:
+            self.probes_started -= 1
+
+    def trip(self):
+        if self.state != OPEN:
+            self.times_opened += 1
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+
+    def retry_after(self) -> int:
+        remaining = self.open_seconds - (time.monotonic() - self.opened_at)
+        return max(1, int(remaining + 0.999))
+
+    def snapshot(self) -> dict:
+        calls, failures, slow_calls = self.window.totals()
+        return {
+            "state": self.state,
+            "window_seconds": self.window.seconds,
+            "calls": calls,
+            "failure_rate": round(failures / calls, 3) if calls else 0.0,
+            "slow_call_rate": round(slow_calls / calls, 3) if calls else 0.0,
+            "retry_after": self.retry_after() if self.state == OPEN else 0,
+            "rejected": self.rejected,
+            "times_opened": self.times_opened,
+            "thresholds": {
+                "failure_rate": self.failure_rate_threshold,
+                "slow_call_rate": self.slow_call_rate_threshold,
+                "slow_call_seconds": self.slow_call_seconds,
+                "min_calls": self.min_calls,
+                "open_seconds": self.open_seconds,
+                "half_open_calls": self.half_open_calls,
+            },
+        }
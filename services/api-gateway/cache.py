@@ -0,0 +1,232 @@
+"""
+In-process response cache for the API Gateway
+Byte-bounded LRU of upstream GET responses with per-route TTLs, upstream
+Cache-Control handling and ETag revalidation
+"""
+
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+
+def parse_cache_control(value: Optional[str]) -> Dict[str, Optional[str]]:
+    """Parse a Cache-Control header into a directive -> argument mapping"""
+    directives = {}
+    for part in (value or "").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        name, _, argument = part.partition("=")
+        directives[name.strip().lower()] = argument.strip().strip('"') or None
+    return directives
+
+
+def etag_matches(if_none_match: Optional[str], etag: Optional[str]) -> bool:
+    """Weak comparison of an If-None-Match header against an ETag"""
+    if not if_none_match or not etag:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    bare = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == bare:
+            return True
+    return False
+
+
+class CacheEntry:
+    """A stored upstream response"""
+
+    def __init__(
+        self,
+        status_code: int,
+        headers: List[Tuple[str, str]],
+        body: bytes,
+        ttl: float,
+        etag: Optional[str] = None,
+        upstream_etag: bool = False,
+    ):
+        self.status_code = status_code
+        self.headers = headers
+        self.body = body
+        self.etag = etag or f'"{hashlib.sha1(body).hexdigest()}"'
+        # Only an upstream-issued ETag can be sent back upstream for revalidation
+        self.upstream_etag = upstream_etag
+        self.size = len(body) + sum(len(k) + len(v) for k, v in headers)
+        self.refresh(ttl)
+
+    def refresh(self, ttl: float):
+        self.stored_at = time.monotonic()
+        self.expires_at = self.stored_at + ttl
+
+    def is_fresh(self) -> bool:
+        return time.monotonic() < self.expires_at
+
+    def age(self) -> int:
+        return int(time.monotonic() - self.stored_at)
+
+
+class ResponseCache:
+    """
+    LRU response cache bounded by total body bytes
+
+    Keys are (path, query, accept-encoding) tuples. Entries are indexed by
+    path so a mutation of a resource can drop every cached variant of it.
+
+    Invalidating a path also moves its generation on, whether or not
+    anything was cached for it; a fill records the generation before going
+    upstream and is not stored if it has changed, so a response read before
+    a write cannot be cached after it. Generations are kept for the most
+    recently invalidated max_tracked paths; older ones fall back to a floor
+    that only ever rises, which errs towards not storing.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int,
+        max_entry_bytes: int,
+        route_ttls: Dict[str, float],
+        max_tracked: int = 10000
+    ):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        # Longest prefix wins when looking up a route TTL
+        self.route_ttls = sorted(route_ttls.items(), key=lambda item: len(item[0]), reverse=True)
+        self.entries: "OrderedDict[tuple, CacheEntry]" = OrderedDict()
+        self.paths: Dict[str, set] = {}
+        self.max_tracked = max_tracked
+        self.epoch = 0
+        self.floor = 0
+        self.invalidated: "OrderedDict[str, int]" = OrderedDict()
+        self.invalidated_prefixes: Dict[str, int] = {}
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.not_modified = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.stale_fills = 0
+
+    def route_ttl(self, path: str) -> Optional[float]:
+        """TTL configured for the route serving path, or None if not cacheable"""
+        for prefix, ttl in self.route_ttls:
+            if path == prefix or path.startswith(prefix.rstrip("/") + "/"):
+                return ttl if ttl > 0 else None
+        return None
+
+    def get(self, key: tuple) -> Optional[CacheEntry]:
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+        return entry
+
+    def generation(self, path: str) -> int:
+        """Invalidation generation of path, to record before fetching it"""
+        stamp = self.invalidated.get(path, self.floor)
+        for prefix, prefix_stamp in self.invalidated_prefixes.items():
+            if prefix_stamp > stamp and (path == prefix or path.startswith(prefix + "/")):
+                stamp = prefix_stamp
+        return stamp
+
+    def stamp(self, path: str):
+        self.epoch += 1
+        self.invalidated[path] = self.epoch
+        self.invalidated.move_to_end(path)
+        while len(self.invalidated) > self.max_tracked:
+            _, oldest = self.invalidated.popitem(last=False)
+            self.floor = max(self.floor, oldest)
+
+    def put(self, key: tuple, entry: CacheEntry, generation: Optional[int] = None):
+        """Store entry, unless its path was invalidated since `generation`"""
+        if entry.size > self.max_entry_bytes:
+            return
+        if generation is not None and self.generation(key[0]) != generation:
+            self.stale_fills += 1
+            return
+        self.remove(key)
+        self.entries[key] = entry
+        self.paths.setdefault(key[0], set()).add(key)
+        self.bytes += entry.size
+        while self.bytes > self.max_bytes and self.entries:
+            oldest = next(iter(self.entries))
+            self.remove(oldest)
+            self.evictions += 1
+
+    def remove(self, key: tuple):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        self.bytes -= entry.size
+        keys = self.paths.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self.paths[key[0]]
+
+    def invalidate(self, *paths: str):
+        """Drop every cached variant of the given paths"""
+        for path in paths:
+            self.stamp(path)
+            for key in list(self.paths.get(path, ())):
+                self.remove(key)
+                self.invalidations += 1
+
+    def invalidate_prefix(self, prefix: str):
+        """Drop every cached path at or under prefix"""
+        prefix = prefix.rstrip("/")
+        self.epoch += 1
+        self.invalidated_prefixes[prefix] = self.epoch
+        self.invalidate(*[
+            path for path in self.paths
+            if path == prefix or path.startswith(prefix + "/")
+        ])
+
+    def storable_ttl(self, route_ttl: float, request_headers, response_headers) -> Optional[float]:
+        """
+        TTL to store a 200 response for, honouring upstream Cache-Control
+        and the shared-cache rules for authenticated requests
+        """
+        directives = parse_cache_control(response_headers.get("cache-control"))
+        if "no-store" in directives or "private" in directives:
+            return None
+        vary = {v.strip().lower() for v in response_headers.get("vary", "").split(",") if v.strip()}
+        if vary - {"accept-encoding", "origin"}:
+            return None
+        if "authorization" in request_headers and not (
+            "public" in directives or "s-maxage" in directives or "must-revalidate" in directives
+        ):
+            return None
+
+        ttl = route_ttl
+        for directive in ("s-maxage", "max-age"):
+            if directives.get(directive) is not None:
+                try:
+                    ttl = min(ttl, float(directives[directive]))
+                except ValueError:
+                    return None
+                break
+        if "no-cache" in directives:
+            # Store, but revalidate upstream before every reuse
+            ttl = 0.0
+        return ttl
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0,
+            "revalidations": self.revalidations,
+            "not_modified": self.not_modified,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "stale_fills": self.stale_fills,
+        }
@@ -0,0 +1,138 @@
+"""
+Request coalescing (single-flight) for the API Gateway
+Concurrent identical idempotent requests share one upstream call
+"""
+
+import asyncio
+from typing import Awaitable, Callable, Dict, Hashable, Optional
+
+import httpx
+
+
+class SharedResponse:
+    """Fully read upstream response that every waiting caller can replay"""
+
+    def __init__(self, status_code: int, headers: httpx.Headers, body: bytes):
+        self.status_code = status_code
+        self.headers = headers
+        self.body = body
+
+    def to_response(self) -> httpx.Response:
+        """Build a fresh httpx response for one caller"""
+        return httpx.Response(
+            self.status_code,
+            headers=self.headers,
+            stream=httpx.ByteStream(self.body)
+        )
+
+
+class UnsharedResponse:
+    """
+    Upstream response too large (or of unknown size) to buffer; it is handed
+    to the first caller that claims it and the others send their own request
+    """
+
+    def __init__(self, response: httpx.Response):
+        self.response = response
+        self.claimed = False
+
+    def claim(self) -> Optional[httpx.Response]:
+        if self.claimed:
+            return None
+        self.claimed = True
+        return self.response
+
+    async def discard(self):
+        if not self.claimed:
+            self.claimed = True
+            await self.response.aclose()
+
+
+async def read_shareable(response: httpx.Response, max_bytes: int):
+    """Buffer a response if its declared size fits within max_bytes"""
+    content_length = response.headers.get("content-length")
+    if content_length is None or int(content_length) > max_bytes:
+        return UnsharedResponse(response)
+    try:
+        body = b"".join([chunk async for chunk in response.aiter_raw()])
+    finally:
+        await response.aclose()
+    return SharedResponse(response.status_code, response.headers, body)
+
+
+class Flight:
+    """One in-progress upstream call and the callers waiting on it"""
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Collapse concurrent calls with the same key into one
+
+    The call runs in its own task, so a caller that is cancelled (e.g. the
+    client disconnected) does not cancel it for the others; the task is only
+    cancelled once every caller has gone. Exceptions propagate to all callers.
+    """
+
+    def __init__(self):
+        self.flights: Dict[Hashable, Flight] = {}
+        self.leaders = 0
+        self.collapsed = 0
+        self.failures = 0
+        self.abandoned = 0
+
+    async def do(
+        self,
+        key: Hashable,
+        fn: Callable[[], Awaitable],
+        discard: Optional[Callable[[object], Awaitable]] = None
+    ):
+        flight = self.flights.get(key)
+        if flight is None:
+            flight = Flight(asyncio.ensure_future(fn()))
+            self.flights[key] = flight
+            flight.task.add_done_callback(lambda task: self.finish(key, flight))
+            self.leaders += 1
+        else:
+            self.collapsed += 1
+
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        except asyncio.CancelledError:
+            if flight.waiters == 1:
+                if not flight.task.done():
+                    self.abandon(key, flight)
+                elif discard is not None and not flight.task.cancelled() and flight.task.exception() is None:
+                    # Result arrived but nobody is left to consume it
+                    await discard(flight.task.result())
+            raise
+        finally:
+            flight.waiters -= 1
+
+    def abandon(self, key: Hashable, flight: Flight):
+        """Cancel a call nobody is waiting for any more"""
+        self.abandoned += 1
+        if self.flights.get(key) is flight:
+            del self.flights[key]
+        flight.task.cancel()
+
+    def finish(self, key: Hashable, flight: Flight):
+        if self.flights.get(key) is flight:
+            del self.flights[key]
+        if not flight.task.cancelled() and flight.task.exception() is not None:
+            self.failures += 1
+
+    def stats(self) -> dict:
+        total = self.leaders + self.collapsed
+        return {
+            "in_flight": len(self.flights),
+            "upstream_calls": self.leaders,
+            "collapsed": self.collapsed,
+            "collapse_ratio": round(self.collapsed / total, 3) if total else 0.0,
+            "failures": self.failures,
+            "abandoned": self.abandoned,
+        }
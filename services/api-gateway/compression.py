@@ -0,0 +1,262 @@
+"""
+Response compression for the API Gateway
+Responses are compressed with the best encoding the client accepts (zstd,
+brotli or gzip), incrementally for streamed bodies; responses the upstream
+already compressed are passed through untouched
+"""
+
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import brotli
+except ImportError:  # brotli is optional
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # zstd is optional
+    zstandard = None
+
+# Content types that are already compressed or not worth compressing
+DEFAULT_SKIP_TYPES = (
+    "image/",
+    "video/",
+    "audio/",
+    "font/woff",
+    "application/zip",
+    "application/gzip",
+    "application/x-gzip",
+    "application/zstd",
+    "application/octet-stream",
+    "application/pdf",
+)
+
+
+def available_encodings() -> List[str]:
+    """Encodings this gateway can produce, in order of preference"""
+    encodings = []
+    if zstandard is not None:
+        encodings.append("zstd")
+    if brotli is not None:
+        encodings.append("br")
+    encodings.append("gzip")
+    return encodings
+
+
+def negotiate(accept_encoding: Optional[str], supported: List[str]) -> Optional[str]:
+    """
+    Pick an encoding from an Accept-Encoding header: the highest q-value
+    wins, ties go to the server's preference order
+    """
+    if not accept_encoding:
+        return None
+    weights: Dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[coding] = q
+
+    best, best_q = None, 0.0
+    for coding in supported:
+        q = weights.get(coding, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+class Encoder:
+    """Incremental compressor for one response body"""
+
+    def __init__(self, encoding: str, levels: Dict[str, int]):
+        self.encoding = encoding
+        level = levels[encoding]
+        if encoding == "gzip":
+            self.compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+        elif encoding == "br":
+            self.compressor = brotli.Compressor(quality=level)
+        else:
+            self.compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        """Compress a chunk and flush it, so streamed output is never held back"""
+        if self.encoding == "gzip":
+            return self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        if self.encoding == "br":
+            return self.compressor.process(data) + self.compressor.flush()
+        return self.compressor.compress(data) + self.compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self, data: bytes = b"") -> bytes:
+        if self.encoding == "gzip":
+            return self.compressor.compress(data) + self.compressor.flush()
+        if self.encoding == "br":
+            return self.compressor.process(data) + self.compressor.finish()
+        return self.compressor.compress(data) + self.compressor.flush()
+
+
+class CompressionStats:
+    """Bytes in and out per encoding"""
+
+    def __init__(self):
+        self.responses: Dict[str, int] = {}
+        self.bytes_in: Dict[str, int] = {}
+        self.bytes_out: Dict[str, int] = {}
+        self.passed_through = 0
+
+    def record(self, encoding: str, bytes_in: int, bytes_out: int):
+        self.responses[encoding] = self.responses.get(encoding, 0) + 1
+        self.bytes_in[encoding] = self.bytes_in.get(encoding, 0) + bytes_in
+        self.bytes_out[encoding] = self.bytes_out.get(encoding, 0) + bytes_out
+
+    def snapshot(self) -> dict:
+        return {
+            "passed_through": self.passed_through,
+            "encodings": {
+                encoding: {
+                    "responses": count,
+                    "bytes_in": self.bytes_in[encoding],
+                    "bytes_out": self.bytes_out[encoding],
+                    "ratio": round(self.bytes_out[encoding] / self.bytes_in[encoding], 3)
+                    if self.bytes_in[encoding] else 0.0,
+                }
+                for encoding, count in self.responses.items()
+            },
+        }
+
+
+class CompressionMiddleware:
+    """
+    ASGI middleware compressing eligible responses
+
+    A response is left alone when it is already encoded, has a skipped
+    content type, is marked no-transform, or is a complete body smaller than
+    min_size. Compressed responses get Vary: Accept-Encoding and have a
+    strong ETag weakened, since the bytes differ from the upstream's.
+    """
+
+    def __init__(
+        self,
+        app,
+        min_size: int,
+        levels: Dict[str, int],
+        encodings: Optional[List[str]] = None,
+        skip_types: Tuple[str, ...] = DEFAULT_SKIP_TYPES,
+        stats: Optional[CompressionStats] = None
+    ):
+        self.app = app
+        self.min_size = min_size
+        self.levels = levels
+        supported = available_encodings()
+        self.encodings = [e for e in (encodings or supported) if e in supported]
+        self.skip_types = skip_types
+        self.stats = stats or CompressionStats()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "HEAD":
+            await self.app(scope, receive, send)
+            return
+
+        accept_encoding = None
+        for name, value in scope["headers"]:
+            if name == b"accept-encoding":
+                accept_encoding = value.decode("latin-1")
+                break
+        encoding = negotiate(accept_encoding, self.encodings)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        encoder: Optional[Encoder] = None
+        bytes_in = bytes_out = 0
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start_message, encoder, bytes_in, bytes_out, passthrough
+            if message["type"] == "http.response.start":
+                if self.eligible(message):
+                    # Hold the headers until the first body chunk shows the size
+                    start_message = message
+                else:
+                    self.stats.passed_through += 1
+                    passthrough = True
+                    await send(message)
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if encoder is None:
+                if not more_body and len(body) < self.min_size:
+                    passthrough = True
+                    await send(start_message)
+                    await send(message)
+                    return
+                encoder = Encoder(encoding, self.levels)
+                headers = self.encoded_headers(start_message["headers"], encoding)
+                if not more_body:
+                    compressed = encoder.finish(body)
+                    headers.append((b"content-length", str(len(compressed)).encode()))
+                    await send({**start_message, "headers": headers})
+                    await send({"type": "http.response.body", "body": compressed})
+                    self.stats.record(encoding, len(body), len(compressed))
+                    return
+                await send({**start_message, "headers": headers})
+
+            bytes_in += len(body)
+            chunk = encoder.compress(body) if more_body else encoder.finish(body)
+            bytes_out += len(chunk)
+            await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+            if not more_body:
+                self.stats.record(encoding, bytes_in, bytes_out)
+
+        await self.app(scope, receive, send_wrapper)
+
+    def eligible(self, message) -> bool:
+        status = message["status"]
+        if status < 200 or status in (204, 304):
+            return False
+        for name, value in message.get("headers", []):
+            if name == b"content-encoding":
+                return False
+            if name == b"content-type":
+                content_type = value.decode("latin-1").lower()
+                if content_type.startswith(self.skip_types):
+                    return False
+            elif name == b"content-length":
+                if int(value) < self.min_size:
+                    return False
+            elif name == b"cache-control" and b"no-transform" in value.lower():
+                return False
+        return True
+
+    def encoded_headers(self, headers, encoding: str) -> list:
+        encoded = []
+        vary = None
+        for name, value in headers:
+            if name == b"content-length":
+                continue
+            if name == b"etag" and not value.startswith(b"W/"):
+                value = b"W/" + value
+            if name == b"vary":
+                vary = value
+                continue
+            encoded.append((name, value))
+        if vary is None:
+            vary = b"Accept-Encoding"
+        elif b"accept-encoding" not in vary.lower() and vary.strip() != b"*":
+            vary = vary + b", Accept-Encoding"
+        encoded.append((b"vary", vary))
+        encoded.append((b"content-encoding", encoding.encode()))
+        return encoded
@@ -0,0 +1,101 @@
+"""
+Edge JWT verification for the API Gateway
+Tokens are verified once at the gateway and the caller's identity is
+forwarded to upstreams as HMAC-signed headers
+"""
+
+import hashlib
+import hmac
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from jose import jwt, JWTError
+
+# Identity headers set by the gateway; any client-supplied copies are dropped
+USER_ID_HEADER = "x-user-id"
+USER_EMAIL_HEADER = "x-user-email"
+USER_EXPIRES_HEADER = "x-user-expires"
+IDENTITY_SIGNATURE_HEADER = "x-identity-signature"
+IDENTITY_HEADERS = frozenset({
+    USER_ID_HEADER,
+    USER_EMAIL_HEADER,
+    USER_EXPIRES_HEADER,
+    IDENTITY_SIGNATURE_HEADER,
+})
+
+
+def sign_identity(secret: str, user_id: str, email: str, expires: str) -> str:
+    """HMAC-SHA256 signature over the forwarded identity fields"""
+    message = f"{user_id}|{email}|{expires}".encode()
+    return hmac.new(secret.encode(), message, hashlib.sha256).hexdigest()
+
+
+class TokenVerifier:
+    """
+    Verifies HS256 bearer tokens and remembers verified tokens until they
+    expire, so repeat requests skip the signature check
+    """
+
+    def __init__(self, jwt_secret: str, identity_secret: str, max_entries: int = 10000):
+        self.jwt_secret = jwt_secret
+        self.identity_secret = identity_secret
+        self.max_entries = max_entries
+        self.verified: "OrderedDict[str, dict]" = OrderedDict()
+        self.hits = 0
+        self.verifications = 0
+        self.failures = 0
+
+    def verify(self, authorization: Optional[str]) -> Optional[dict]:
+        """Return the token's claims, or None if it is missing or invalid"""
+        if not authorization or not authorization.startswith("Bearer "):
+            return None
+        token = authorization[len("Bearer "):]
+
+        claims = self.verified.get(token)
+        if claims is not None:
+            if claims["exp"] > time.time():
+                self.verified.move_to_end(token)
+                self.hits += 1
+                return claims
+            del self.verified[token]
+
+        self.verifications += 1
+        try:
+            payload = jwt.decode(token, self.jwt_secret, algorithms=["HS256"])
+        except JWTError:
+            self.failures += 1
+            return None
+        if "userId" not in payload or "exp" not in payload:
+            self.failures += 1
+            return None
+
+        claims = {
+            "userId": payload["userId"],
+            "email": payload.get("email", ""),
+            "exp": int(payload["exp"]),
+        }
+        self.verified[token] = claims
+        if len(self.verified) > self.max_entries:
+            self.verified.popitem(last=False)
+        return claims
+
+    def identity_headers(self, claims: dict) -> list:
+        """Signed identity headers to forward upstream"""
+        user_id = str(claims["userId"])
+        email = claims["email"]
+        expires = str(claims["exp"])
+        return [
+            (USER_ID_HEADER, user_id),
+            (USER_EMAIL_HEADER, email),
+            (USER_EXPIRES_HEADER, expires),
+            (IDENTITY_SIGNATURE_HEADER, sign_identity(self.identity_secret, user_id, email, expires)),
+        ]
+
+    def stats(self) -> dict:
+        return {
+            "cached_tokens": len(self.verified),
+            "cache_hits": self.hits,
+            "verifications": self.verifications,
+            "failures": self.failures,
+        }
@@ -5,15 +5,32 @@ Single entry point for all client requests, routes to microservices
 
 from fastapi import FastAPI, Request, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
+from pydantic import BaseModel
 import httpx
+import asyncio
+import json
 import os
-from typing import Optional
+import time
+from typing import Any, Dict, List, Optional
 import logging
-from datetime import datetime
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+from accesslog import AccessLog, AccessLogMiddleware
+from admission import AdmissionController, Overloaded, RouteClass
+from breaker import CircuitBreaker, CircuitOpenError
+from cache import CacheEntry, ResponseCache, etag_matches, parse_cache_control
+from compression import CompressionMiddleware, CompressionStats
+from coalescing import SharedResponse, SingleFlight, read_shareable
+from hedging import HedgingPolicy, route_template, send_with_retries
+from identity import IDENTITY_HEADERS, TokenVerifier
+from pools import UpstreamPool
+
+# Configure logging; timestamps are added by the formatter only for records
+# that are emitted, and per-request client logging is left to the access log
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+logging.getLogger("httpx").setLevel(logging.WARNING)
+logging.getLogger("httpcore").setLevel(logging.WARNING)
 logger = logging.getLogger(__name__)
 
 app = FastAPI(
@@ -31,6 +48,41 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Response compression negotiated from Accept-Encoding (zstd, br, gzip);
+# lower levels trade egress bandwidth for gateway CPU
+COMPRESSION_ENABLED = os.getenv("COMPRESSION_ENABLED", "true").lower() == "true"
+compression_stats = CompressionStats()
+if COMPRESSION_ENABLED:
+    app.add_middleware(
+        CompressionMiddleware,
+        min_size=int(os.getenv("COMPRESSION_MIN_BYTES", "1024")),
+        levels={
+            "gzip": int(os.getenv("GZIP_LEVEL", "5")),
+            "br": int(os.getenv("BROTLI_QUALITY", "4")),
+            "zstd": int(os.getenv("ZSTD_LEVEL", "3")),
+        },
+        encodings=[e.strip() for e in os.getenv("COMPRESSION_ENCODINGS", "zstd,br,gzip").split(",") if e.strip()],
+        stats=compression_stats
+    )
+
+# Access log: one sampled record per request, written in batches off the
+# event loop; 5xx and slow requests are always kept, and requests rejected
+# by a breaker or admission control are summarized once per flush
+ACCESS_LOG_ENABLED = os.getenv("ACCESS_LOG_ENABLED", "true").lower() == "true"
+access_log = AccessLog(
+    capacity=int(os.getenv("ACCESS_LOG_BUFFER", "16384")),
+    flush_interval=float(os.getenv("ACCESS_LOG_FLUSH_INTERVAL", "1.0")),
+    batch_size=int(os.getenv("ACCESS_LOG_BATCH_SIZE", "1024")),
+    sample_rates={
+        2: float(os.getenv("ACCESS_LOG_SAMPLE_2XX", "0.1")),
+        3: float(os.getenv("ACCESS_LOG_SAMPLE_3XX", "0.1")),
+        4: float(os.getenv("ACCESS_LOG_SAMPLE_4XX", "1.0")),
+    },
+    slow_seconds=float(os.getenv("ACCESS_LOG_SLOW_MS", "1000")) / 1000
+)
+if ACCESS_LOG_ENABLED:
+    app.add_middleware(AccessLogMiddleware, access_log=access_log)
+
 # Configuration
 PORT = int(os.getenv("PORT", "8080"))
 TIMEOUT = 60.0  # 60 seconds timeout
@@ -41,17 +93,404 @@ PRODUCT_SERVICE = os.getenv("PRODUCT_SERVICE_URL", "http://product-service:3002"
 ORDER_SERVICE = os.getenv("ORDER_SERVICE_URL", "http://order-service:3003")
 PAYMENT_SERVICE = os.getenv("PAYMENT_SERVICE_URL", "http://payment-service:3004")
 
-# HTTP client for proxying
-client = httpx.AsyncClient(timeout=TIMEOUT, follow_redirects=True)
+# Edge authentication: tokens are verified once here and the identity is
+# forwarded upstream as signed headers
+JWT_SECRET = os.getenv("JWT_SECRET", "your-secret-key-change-in-production")
+GATEWAY_IDENTITY_SECRET = os.getenv("GATEWAY_IDENTITY_SECRET", JWT_SECRET)
+token_verifier = TokenVerifier(
+    JWT_SECRET,
+    GATEWAY_IDENTITY_SECRET,
+    max_entries=int(os.getenv("JWT_CACHE_SIZE", "10000"))
+)
+
+# Hop-by-hop headers are meaningful only for a single connection (RFC 7230)
+HOP_BY_HOP_HEADERS = frozenset({
+    "connection",
+    "keep-alive",
+    "proxy-authenticate",
+    "proxy-authorization",
+    "te",
+    "trailers",
+    "transfer-encoding",
+    "upgrade",
+})
+
+# Dedicated HTTP client per upstream so one slow service cannot starve the others
+user_pool = UpstreamPool("USER_SERVICE", USER_SERVICE, TIMEOUT)
+product_pool = UpstreamPool("PRODUCT_SERVICE", PRODUCT_SERVICE, TIMEOUT)
+order_pool = UpstreamPool("ORDER_SERVICE", ORDER_SERVICE, TIMEOUT)
+payment_pool = UpstreamPool("PAYMENT_SERVICE", PAYMENT_SERVICE, TIMEOUT)
+upstream_pools = [user_pool, product_pool, order_pool, payment_pool]
+
+# Route prefixes and the upstream serving them
+ROUTES = [
+    ("/api/users", user_pool),
+    ("/api/products", product_pool),
+    ("/api/orders", order_pool),
+    ("/api/payments", payment_pool),
+]
+
+# Circuit breaker per upstream, and a deadline per route for the upstream to
+# start responding (both well below TIMEOUT so a hung service fails fast)
+breakers = {pool.name: CircuitBreaker(pool.name) for pool in upstream_pools}
+
+# Retry budget and opt-in hedging (<NAME>_HEDGING=true) per upstream
+hedging_policies = {pool.name: HedgingPolicy(pool.name) for pool in upstream_pools}
+ROUTE_DEADLINES = {
+    "/api/users": float(os.getenv("USERS_ROUTE_DEADLINE", "10")),
+    "/api/products": float(os.getenv("PRODUCTS_ROUTE_DEADLINE", "5")),
+    "/api/orders": float(os.getenv("ORDERS_ROUTE_DEADLINE", "15")),
+    "/api/payments": float(os.getenv("PAYMENTS_ROUTE_DEADLINE", "30")),
+}
+
+# Adaptive admission control; checkout is admitted ahead of account and
+# browsing traffic and may use all of the gateway-wide concurrency
+admission = AdmissionController(global_limit=int(os.getenv("GATEWAY_MAX_CONCURRENCY", "500")))
+admission.add_class(RouteClass(
+    "checkout", priority=0, prefixes=["/api/orders", "/api/payments"],
+    share=1.0, max_queue=200, queue_timeout=5.0
+))
+admission.add_class(RouteClass(
+    "account", priority=1, prefixes=["/api/users"],
+    share=0.9, max_queue=100, queue_timeout=2.0
+))
+admission.add_class(RouteClass(
+    "browse", priority=2, prefixes=["/api/products"],
+    share=0.8, max_queue=50, queue_timeout=1.0
+))
+
+# Response cache for catalog reads; a TTL of 0 disables caching for a route
+response_cache = ResponseCache(
+    max_bytes=int(os.getenv("CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+    max_entry_bytes=int(os.getenv("CACHE_MAX_ENTRY_BYTES", str(1024 * 1024))),
+    route_ttls={
+        "/api/products": float(os.getenv("PRODUCT_CACHE_TTL", "30")),
+    }
+)
+MUTATING_METHODS = frozenset({"POST", "PUT", "PATCH", "DELETE"})
+
+# POST endpoints that only read (lookups too long for a query string)
+READ_ONLY_POST_PATHS = frozenset({"/api/products/batch"})
+
+# Bulk writes that may change any resource under a prefix. They stream
+# large bodies and run for as long as the upstream needs, so they get no
+# route deadline, a long read timeout and no latency charged to the breaker
+BULK_MUTATIONS = {
+    ("POST", "/api/products/import"): "/api/products",
+    ("PATCH", "/api/products"): "/api/products",
+}
+BULK_MUTATION_TIMEOUT = float(os.getenv("BULK_MUTATION_TIMEOUT", "600"))
+
+# Cached views computed across a collection's resources, dropped along with
+# the collection itself (listings, including searches) on any write to it
+DERIVED_VIEWS = {
+    "/api/products": ("/api/products/batch", "/api/products/facets"),
+}
+
+# Single-flight for identical concurrent GETs; the key is method, URL and
+# the values of these request headers
+COALESCE_ENABLED = os.getenv("COALESCE_ENABLED", "true").lower() == "true"
+COALESCE_VARY_HEADERS = [
+    name.strip().lower()
+    for name in os.getenv("COALESCE_VARY_HEADERS", "accept,accept-encoding,authorization,cookie").split(",")
+    if name.strip()
+]
+COALESCE_MAX_BYTES = int(os.getenv("COALESCE_MAX_BYTES", str(1024 * 1024)))
+coalescer = SingleFlight()
+
+
+def filter_hop_by_hop(headers) -> list:
+    """
+    Drop hop-by-hop headers (RFC 7230 section 6.1), including any header
+    named in the Connection header, so they are not forwarded across the proxy
+    """
+    connection_tokens = {
+        token.strip().lower()
+        for token in headers.get("connection", "").split(",")
+        if token.strip()
+    }
+    return [
+        (name, value)
+        for name, value in headers.items()
+        if name.lower() not in HOP_BY_HOP_HEADERS and name.lower() not in connection_tokens
+    ]
+
+
+async def relay_body(response: httpx.Response):
+    """Relay the upstream body chunk by chunk, releasing the connection when done"""
+    try:
+        async for chunk in response.aiter_raw():
+            yield chunk
+    finally:
+        await response.aclose()
+
+
+def set_headers(response: Response, headers: list) -> Response:
+    """Replace response headers, keeping repeated headers such as Set-Cookie"""
+    response.raw_headers = [
+        (name.lower().encode("latin-1"), value.encode("latin-1"))
+        for name, value in headers
+    ]
+    return response
+
+
+def stream_upstream_response(response: httpx.Response) -> StreamingResponse:
+    """
+    Relay an upstream response without buffering; the background task closes
+    the upstream response even if the client disconnects before the body is
+    consumed
+    """
+    streaming = StreamingResponse(
+        relay_body(response),
+        status_code=response.status_code,
+        background=BackgroundTask(response.aclose)
+    )
+    return set_headers(streaming, filter_hop_by_hop(response.headers))
+
+
+def cached_response(request: Request, entry: CacheEntry, cache_status: str) -> Response:
+    """Serve a cache entry, answering the client's If-None-Match with a 304"""
+    headers = [(name, value) for name, value in entry.headers if name.lower() != "etag"]
+    headers += [
+        ("etag", entry.etag),
+        ("age", str(entry.age())),
+        ("x-cache", cache_status),
+    ]
+    if etag_matches(request.headers.get("if-none-match"), entry.etag):
+        response_cache.not_modified += 1
+        keep = {"cache-control", "content-location", "date", "etag", "expires", "vary", "age", "x-cache"}
+        return set_headers(
+            Response(status_code=304),
+            [(name, value) for name, value in headers if name.lower() in keep]
+        )
+    return set_headers(Response(content=entry.body, status_code=entry.status_code), headers)
+
+
+async def send_upstream(
+    request: Request,
+    upstream: UpstreamPool,
+    target_url: str,
+    headers: list,
+    deadline: Optional[float],
+    bulk: bool = False
+) -> httpx.Response:
+    """
+    Send the request upstream, streaming the body and leaving the response
+    unread; the outcome feeds the upstream's circuit breaker
+
+    The deadline runs from admission until the response headers arrive, so
+    time spent queued in the gateway is not charged to the upstream, and a
+    missed deadline is recorded once per upstream call.
+    """
+    breaker = breakers[upstream.name]
+    breaker.allow()
+    
+    # Wait for an admission slot for this route class (or get shed)
+    route_class = admission.classify(request.url.path)
+    if route_class is not None:
+        try:
+            await admission.acquire(route_class)
+        except BaseException:
+            breaker.release()
+            raise
+    
+    # Stream the request body only when the client actually sent one
+    has_body = "content-length" in request.headers or "transfer-encoding" in request.headers
+    
+    client = upstream.client
+    
+    async def attempt(routing: Optional[dict] = None) -> httpx.Response:
+        upstream_request = client.build_request(
+            method=request.method,
+            url=target_url,
+            headers=headers,
+            content=request.stream() if has_body else None,
+            timeout=httpx.Timeout(TIMEOUT, read=BULK_MUTATION_TIMEOUT, write=BULK_MUTATION_TIMEOUT)
+            if bulk else httpx.USE_CLIENT_DEFAULT,
+            extensions={"routing": routing} if routing is not None else None
+        )
+        return await client.send(upstream_request, stream=True)
+    
+    # Only idempotent requests without a body may be retried or hedged
+    policy = hedging_policies[upstream.name]
+    policy.budget.deposit()
+    idempotent = request.method in ("GET", "HEAD") and not has_body
+    
+    started = time.perf_counter()
+    
+    def elapsed() -> Optional[float]:
+        # A bulk write's duration says nothing about the upstream's health
+        return None if bulk else time.perf_counter() - started
+    
+    failed = True
+    try:
+        if idempotent:
+            # Hedge delays are per route; a hedge goes to a different replica
+            route = route_template(request.method, request.url.path)
+            call = send_with_retries(attempt, policy, route, len(upstream.endpoints.endpoints))
+        else:
+            call = attempt()
+        if deadline is not None:
+            response = await asyncio.wait_for(call, deadline)
+        else:
+            response = await call
+        failed = response.status_code >= 500
+    except asyncio.CancelledError:
+        # Cut off by the client going away
+        breaker.release()
+        raise
+    except httpx.TimeoutException:
+        # A bulk write outliving even its long timeout is the write's size,
+        # not a sign the upstream is failing
+        if bulk:
+            breaker.release()
+        else:
+            breaker.record(elapsed(), failed=True)
+        raise
+    except Exception:
+        breaker.record(elapsed() or 0.0, failed=True)
+        raise
+    finally:
+        # The slot covers the upstream call up to its response headers
+        if route_class is not None:
+            admission.release(route_class, elapsed(), failed)
+    
+    breaker.record(elapsed() or 0.0, failed=failed)
+    return response
+
+
+async def send_coalesced(
+    request: Request,
+    upstream: UpstreamPool,
+    target_url: str,
+    headers: list,
+    deadline: Optional[float],
+    bulk: bool = False
+) -> httpx.Response:
+    """
+    Send an idempotent request upstream, sharing one upstream call between
+    identical concurrent requests
+    """
+    has_body = "content-length" in request.headers or "transfer-encoding" in request.headers
+    if not COALESCE_ENABLED or request.method not in ("GET", "HEAD") or has_body:
+        return await send_upstream(request, upstream, target_url, headers, deadline, bulk)
+    
+    # A request arriving after a write must not share a read sent before it
+    sent = {name.lower(): value for name, value in headers}
+    key = (
+        request.method,
+        target_url,
+        response_cache.generation(request.url.path),
+        sent.get("if-none-match"),
+        tuple(sent.get(name) for name in COALESCE_VARY_HEADERS)
+    )
+    
+    async def fetch():
+        response = await send_upstream(request, upstream, target_url, headers, deadline)
+        return await read_shareable(response, COALESCE_MAX_BYTES)
+    
+    async def discard(result):
+        if not isinstance(result, SharedResponse):
+            await result.discard()
+    
+    result = await coalescer.do(key, fetch, discard)
+    if isinstance(result, SharedResponse):
+        return result.to_response()
+    response = result.claim()
+    if response is None:
+        # Another caller took the unbuffered stream; fetch our own copy
+        return await send_upstream(request, upstream, target_url, headers, deadline)
+    return response
+
+
+async def fetch_cacheable(
+    request: Request,
+    upstream: UpstreamPool,
+    target_url: str,
+    headers: list,
+    route_ttl: float,
+    deadline: float
+) -> Response:
+    """
+    Serve a cacheable GET from the response cache, revalidating stale entries
+    upstream with If-None-Match when the upstream issued the ETag
+    """
+    key = (
+        request.url.path,
+        request.url.query,
+        request.headers.get("accept-encoding", "identity").replace(" ", "").lower()
+    )
+    request_directives = parse_cache_control(request.headers.get("cache-control"))
+    entry = response_cache.get(key)
+    
+    if entry is not None and entry.is_fresh() and "no-cache" not in request_directives:
+        response_cache.hits += 1
+        return cached_response(request, entry, "HIT")
+    
+    # The gateway answers conditionals itself, so only its own validators go upstream
+    headers = [
+        (name, value) for name, value in headers
+        if name.lower() not in ("if-none-match", "if-modified-since")
+    ]
+    if entry is not None and entry.upstream_etag:
+        headers.append(("if-none-match", entry.etag))
+    
+    # A write that invalidates this path while we are upstream voids the fill
+    generation = response_cache.generation(request.url.path)
+    response = await send_coalesced(request, upstream, target_url, headers, deadline)
+    
+    if response.status_code == 304 and entry is not None:
+        await response.aclose()
+        ttl = response_cache.storable_ttl(route_ttl, request.headers, response.headers)
+        entry.refresh(ttl if ttl is not None else 0.0)
+        response_cache.hits += 1
+        response_cache.revalidations += 1
+        return cached_response(request, entry, "REVALIDATED")
+    
+    response_cache.misses += 1
+    ttl = None
+    if response.status_code == 200:
+        ttl = response_cache.storable_ttl(route_ttl, request.headers, response.headers)
+    content_length = response.headers.get("content-length")
+    if (
+        ttl is None
+        or content_length is None
+        or int(content_length) > response_cache.max_entry_bytes
+    ):
+        # Not storable for this caller (credentials, private, too large):
+        # pass it through and leave any shared entry for the others
+        return stream_upstream_response(response)
+    
+    try:
+        body = b"".join([chunk async for chunk in response.aiter_raw()])
+    finally:
+        await response.aclose()
+    
+    upstream_etag = response.headers.get("etag")
+    entry = CacheEntry(
+        status_code=response.status_code,
+        headers=filter_hop_by_hop(response.headers),
+        body=body,
+        ttl=ttl,
+        etag=upstream_etag,
+        upstream_etag=upstream_etag is not None
+    )
+    response_cache.put(key, entry, generation)
+    return cached_response(request, entry, "MISS")
 
 
 async def proxy_request(
     request: Request,
-    service_url: str,
+    upstream: UpstreamPool,
     path_rewrite: Optional[str] = None
 ):
     """
     Proxy request to a microservice
+
+    The request body is streamed upstream as it arrives and the upstream
+    response is relayed to the client chunk by chunk, so payloads are never
+    buffered in the gateway. GETs on routes with a cache TTL are served
+    through the response cache instead.
     """
     # Rewrite path if needed (remove /api/{service} prefix)
     target_path = request.url.path
@@ -60,53 +499,97 @@ async def proxy_request(
         if not target_path.startswith("/"):
             target_path = "/" + target_path
     
-    target_url = f"{service_url}{target_path}"
+    target_url = f"{upstream.base_url}{target_path}"
     
     # Build query string
     if request.url.query:
         target_url += f"?{request.url.query}"
     
-    logger.info(f"[{datetime.now().isoformat()}] Proxying {request.method} {request.url.path} to {target_url}")
+    # Time allowed for the upstream to start responding on this route
+    bulk_prefix = BULK_MUTATIONS.get((request.method, request.url.path.rstrip("/")))
+    deadline = None if bulk_prefix is not None else ROUTE_DEADLINES.get(path_rewrite, TIMEOUT)
     
     try:
-        # Prepare headers (exclude host and connection)
-        headers = dict(request.headers)
-        headers.pop("host", None)
-        headers.pop("connection", None)
+        # Prepare headers (exclude host, hop-by-hop and spoofed identity headers)
+        headers = [
+            (name, value)
+            for name, value in filter_hop_by_hop(request.headers)
+            if name.lower() != "host" and name.lower() not in IDENTITY_HEADERS
+        ]
+        claims = token_verifier.verify(request.headers.get("authorization"))
+        if claims is not None:
+            headers += token_verifier.identity_headers(claims)
+        # The body is relayed raw, so never let httpx negotiate an encoding
+        # the client did not ask for
+        if "accept-encoding" not in request.headers:
+            headers.append(("accept-encoding", "identity"))
         
-        # Get request body
-        body = await request.body()
+        route_ttl = response_cache.route_ttl(request.url.path)
+        if request.method == "GET" and route_ttl is not None:
+            return await fetch_cacheable(request, upstream, target_url, headers, route_ttl, deadline)
         
-        # Make request to target service
-        response = await client.request(
-            method=request.method,
-            url=target_url,
-            headers=headers,
-            content=body,
-            cookies=request.cookies
+        # Make request to target service without buffering the response
+        response = await send_coalesced(
+            request, upstream, target_url, headers, deadline, bulk=bulk_prefix is not None
         )
         
-        logger.info(f"[{datetime.now().isoformat()}] Response from {request.url.path}: {response.status_code}")
+        if request.method in MUTATING_METHODS and request.url.path not in READ_ONLY_POST_PATHS:
+            if bulk_prefix is not None:
+                response_cache.invalidate_prefix(bulk_prefix)
+            else:
+                invalidate_cached(request.url.path)
         
-        # Return response
-        return StreamingResponse(
-            iter([response.content]),
-            status_code=response.status_code,
-            headers=dict(response.headers),
-            media_type=response.headers.get("content-type")
-        )
+        return stream_upstream_response(response)
     
+    except CircuitOpenError as e:
+        access_log.count_rejection("circuit open", e.name)
+        return JSONResponse(
+            status_code=503,
+            content={
+                "error": "Service Unavailable",
+                "message": f"{e.name} is temporarily unavailable, retry after {e.retry_after}s"
+            },
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    except Overloaded as e:
+        access_log.count_rejection(f"shed ({e.reason})", e.route_class)
+        return JSONResponse(
+            status_code=e.status_code,
+            content={
+                "error": "Too Many Requests" if e.status_code == 429 else "Service Unavailable",
+                "message": f"Gateway is overloaded ({e.reason}), retry after {e.retry_after}s"
+            },
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    except asyncio.TimeoutError:
+        # send_upstream has already charged the missed deadline to the breaker
+        logger.error("Deadline of %ss exceeded for %s", deadline, request.url.path)
+        raise HTTPException(status_code=504, detail="Gateway timeout")
     except httpx.TimeoutException:
-        logger.error(f"[{datetime.now().isoformat()}] Timeout for {request.url.path}")
+        logger.error("Timeout for %s", request.url.path)
         raise HTTPException(status_code=504, detail="Gateway timeout")
     except httpx.ConnectError:
-        logger.error(f"[{datetime.now().isoformat()}] Connection error for {target_url}")
+        logger.error("Connection error for %s", target_url)
         raise HTTPException(status_code=503, detail="Service unavailable")
     except Exception as e:
-        logger.error(f"[{datetime.now().isoformat()}] Proxy error for {request.url.path}: {str(e)}")
+        logger.error("Proxy error for %s: %s", request.url.path, e)
         raise HTTPException(status_code=500, detail=f"Internal gateway error: {str(e)}")
 
 
+def invalidate_cached(path: str):
+    """
+    Drop cached copies of a mutated resource, of its parent collection and
+    of the views derived from it, e.g. PUT /api/products/7 invalidates
+    /api/products/7, /api/products/, /api/products/batch and /facets
+    """
+    resource = path.rstrip("/")
+    collection = resource.rsplit("/", 1)[0]
+    response_cache.invalidate(resource, resource + "/", collection, collection + "/")
+    for prefix, views in DERIVED_VIEWS.items():
+        if resource == prefix or resource.startswith(prefix + "/"):
+            response_cache.invalidate(*views)
+
+
 # Health check
 @app.get("/health")
 async def health_check():
@@ -114,6 +597,32 @@ async def health_check():
     return {"status": "ok", "service": "api-gateway"}
 
 
+# Gateway statistics
+@app.get("/gateway/stats")
+async def gateway_stats():
+    """Connection pool, admission, cache, coalescing, auth, logging and compression counters"""
+    return {
+        "pools": {pool.name: pool.snapshot() for pool in upstream_pools},
+        "admission": admission.stats(),
+        "hedging": {name: policy.stats() for name, policy in hedging_policies.items()},
+        "cache": response_cache.stats(),
+        "coalescing": coalescer.stats(),
+        "auth": token_verifier.stats(),
+        "access_log": access_log.stats(),
+        "compression": compression_stats.snapshot()
+    }
+
+
+# Circuit breaker state
+@app.get("/gateway/breakers")
+async def gateway_breakers():
+    """Circuit breaker state and rolling error/latency rates per upstream"""
+    return {
+        "breakers": {name: breaker.snapshot() for name, breaker in breakers.items()},
+        "deadlines": ROUTE_DEADLINES
+    }
+
+
 # API Info endpoint
 @app.get("/")
 async def api_info():
@@ -126,7 +635,11 @@ async def api_info():
         "framework": "FastAPI",
         "endpoints": {
             "health": "/health",
+            "stats": "/gateway/stats",
+            "breakers": "/gateway/breakers",
             "api": {
+                "batch": "/api/batch",
+                "order_details": "/api/orders/{order_id}/details",
                 "users": "/api/users",
                 "products": "/api/products",
                 "orders": "/api/orders",
@@ -144,32 +657,232 @@ async def api_info():
     }
 
 
+# Batch requests
+BATCH_MAX_REQUESTS = int(os.getenv("BATCH_MAX_REQUESTS", "20"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "6"))
+BATCH_METHODS = {"GET", "POST", "PUT", "DELETE", "PATCH"}
+# Headers of the batch request that every sub-request inherits
+BATCH_INHERITED_HEADERS = {"authorization", "cookie", "user-agent", "accept-language"}
+
+
+class SubRequest(BaseModel):
+    id: Optional[str] = None
+    method: str = "GET"
+    path: str
+    headers: Dict[str, str] = {}
+    body: Optional[Any] = None
+
+
+class BatchRequest(BaseModel):
+    requests: List[SubRequest]
+
+
+def build_sub_request(parent: Request, sub: SubRequest, inherit_headers: bool = True) -> Request:
+    """Build a request for one batch entry, sharing the parent's connection scope"""
+    path, _, query = sub.path.partition("?")
+    body = b"" if sub.body is None else json.dumps(sub.body).encode()
+    
+    headers = {
+        name: value for name, value in parent.headers.items()
+        if inherit_headers and name in BATCH_INHERITED_HEADERS
+    }
+    # Sub-responses are decoded into the batch document, so never compress them
+    headers.update({
+        name.lower(): value for name, value in sub.headers.items()
+        if name.lower() not in ("accept-encoding", "content-length", "transfer-encoding", "host")
+    })
+    if body:
+        headers.setdefault("content-type", "application/json")
+        headers["content-length"] = str(len(body))
+    
+    scope = {
+        **parent.scope,
+        "method": sub.method.upper(),
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": query.encode(),
+        "headers": [(name.encode("latin-1"), value.encode("latin-1")) for name, value in headers.items()],
+    }
+    
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+    
+    return Request(scope, receive)
+
+
+async def run_sub_request(
+    parent: Request,
+    index: int,
+    sub: SubRequest,
+    semaphore: asyncio.Semaphore,
+    inherit_headers: bool = True
+) -> dict:
+    """Run one batch entry through proxy_request and collect its response"""
+    result = {"id": sub.id if sub.id is not None else str(index)}
+    method = sub.method.upper()
+    path = sub.path.partition("?")[0]
+    route = next(
+        ((prefix, pool) for prefix, pool in ROUTES if path == prefix or path.startswith(prefix + "/")),
+        None
+    )
+    if method not in BATCH_METHODS or route is None:
+        result.update(status=404, headers={}, body={"error": "Not Found", "message": f"Route {method} {path} not found"})
+        return result
+    
+    async with semaphore:
+        try:
+            response = await proxy_request(
+                build_sub_request(parent, sub, inherit_headers),
+                route[1],
+                route[0]
+            )
+        except HTTPException as e:
+            result.update(status=e.status_code, headers={}, body={"detail": e.detail})
+            return result
+        
+        if isinstance(response, StreamingResponse):
+            try:
+                body = b"".join([chunk async for chunk in response.body_iterator])
+            finally:
+                if response.background is not None:
+                    await response.background()
+        else:
+            body = response.body
+    
+    headers = {
+        name.decode("latin-1"): value.decode("latin-1")
+        for name, value in response.raw_headers
+        if name.lower() not in (b"content-length", b"date", b"server")
+    }
+    content_type = headers.get("content-type", "")
+    if body and "json" in content_type:
+        try:
+            decoded = json.loads(body)
+        except ValueError:
+            decoded = body.decode("utf-8", "replace")
+    else:
+        decoded = body.decode("utf-8", "replace") if body else None
+    result.update(status=response.status_code, headers=headers, body=decoded)
+    return result
+
+
+@app.post("/api/batch")
+async def batch(request: Request, batch_request: BatchRequest, stream: bool = False):
+    """
+    Run several API requests concurrently in one round trip
+
+    Returns 207 Multi-Status with one entry per sub-request, in request
+    order. With ?stream=true (or Accept: application/x-ndjson) each result
+    is streamed as an NDJSON line as soon as it completes.
+    """
+    subs = batch_request.requests
+    if not subs:
+        raise HTTPException(status_code=400, detail="Batch must contain at least one request")
+    if len(subs) > BATCH_MAX_REQUESTS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Batch may contain at most {BATCH_MAX_REQUESTS} requests"
+        )
+    
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+    tasks = [
+        asyncio.ensure_future(run_sub_request(request, index, sub, semaphore))
+        for index, sub in enumerate(subs)
+    ]
+    
+    if stream or "application/x-ndjson" in request.headers.get("accept", ""):
+        async def results():
+            try:
+                for finished in asyncio.as_completed(tasks):
+                    yield json.dumps(await finished).encode() + b"\n"
+            finally:
+                for task in tasks:
+                    task.cancel()
+        
+        return StreamingResponse(results(), status_code=207, media_type="application/x-ndjson")
+    
+    try:
+        responses = await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+    return JSONResponse(status_code=207, content={"responses": responses})
+
+
+# Composite endpoints
+ORDER_DETAILS_CONCURRENCY = int(os.getenv("ORDER_DETAILS_CONCURRENCY", "10"))
+# Most product ids per Product Service bulk lookup (its MAX_BATCH_SIZE)
+ORDER_DETAILS_BATCH_SIZE = int(os.getenv("ORDER_DETAILS_BATCH_SIZE", "100"))
+
+
+@app.get("/api/orders/{order_id}/details")
+async def order_details(request: Request, order_id: int):
+    """
+    Order with every line item hydrated with its product, in one round trip
+
+    The order is fetched with the caller's credentials, then its distinct
+    products with one bulk lookup per ORDER_DETAILS_BATCH_SIZE ids, sent
+    without them so the lookup is served from the gateway cache where
+    possible.
+    """
+    semaphore = asyncio.Semaphore(ORDER_DETAILS_CONCURRENCY)
+    order_result = await run_sub_request(
+        request, 0, SubRequest(path=f"/api/orders/{order_id}"), semaphore
+    )
+    if order_result["status"] != 200:
+        return JSONResponse(status_code=order_result["status"], content=order_result["body"])
+    
+    order = order_result["body"]["order"]
+    product_ids = sorted({item["product_id"] for item in order["items"]})
+    batches = [
+        product_ids[i:i + ORDER_DETAILS_BATCH_SIZE]
+        for i in range(0, len(product_ids), ORDER_DETAILS_BATCH_SIZE)
+    ]
+    batch_results = await asyncio.gather(*[
+        run_sub_request(
+            request, index, SubRequest(path=f"/api/products/batch?ids={','.join(map(str, batch))}"),
+            semaphore, inherit_headers=False
+        )
+        for index, batch in enumerate(batches)
+    ])
+    products = {
+        int(product_id): product
+        for result in batch_results if result["status"] == 200
+        for product_id, product in result["body"]["products"].items()
+    }
+    
+    for item in order["items"]:
+        item["product"] = products.get(item["product_id"])
+    order["missing_product_ids"] = [pid for pid in product_ids if pid not in products]
+    return {"order": order}
+
+
 # Route proxying - Users Service
 @app.api_route("/api/users/{path:path}", methods=["GET", "POST", "PUT", "DELETE", "PATCH", "OPTIONS"])
 async def proxy_users(request: Request, path: str):
     """Proxy requests to User Service"""
-    return await proxy_request(request, USER_SERVICE, "/api/users")
+    return await proxy_request(request, user_pool, "/api/users")
 
 
 # Route proxying - Products Service
 @app.api_route("/api/products/{path:path}", methods=["GET", "POST", "PUT", "DELETE", "PATCH", "OPTIONS"])
 async def proxy_products(request: Request, path: str):
     """Proxy requests to Product Service"""
-    return await proxy_request(request, PRODUCT_SERVICE, "/api/products")
+    return await proxy_request(request, product_pool, "/api/products")
 
 
 # Route proxying - Orders Service
 @app.api_route("/api/orders/{path:path}", methods=["GET", "POST", "PUT", "DELETE", "PATCH", "OPTIONS"])
 async def proxy_orders(request: Request, path: str):
     """Proxy requests to Order Service"""
-    return await proxy_request(request, ORDER_SERVICE, "/api/orders")
+    return await proxy_request(request, order_pool, "/api/orders")
 
 
 # Route proxying - Payments Service
 @app.api_route("/api/payments/{path:path}", methods=["GET", "POST", "PUT", "DELETE", "PATCH", "OPTIONS"])
 async def proxy_payments(request: Request, path: str):
     """Proxy requests to Payment Service"""
-    return await proxy_request(request, PAYMENT_SERVICE, "/api/payments")
+    return await proxy_request(request, payment_pool, "/api/payments")
 
 
 # 404 handler
@@ -184,10 +897,13 @@ async def not_found(request: Request, path: str):
             "availableEndpoints": [
                 "/",
                 "/health",
+                "/gateway/stats",
+                "/gateway/breakers",
                 "/api/users",
                 "/api/products",
                 "/api/orders",
-                "/api/payments"
+                "/api/payments",
+                "/api/batch"
             ]
         }
     )
@@ -195,7 +911,11 @@ async def not_found(request: Request, path: str):
 
 @app.on_event("startup")
 async def startup_event():
-    """Log service URLs on startup"""
+    """Start replica discovery and the access log writer, log service URLs"""
+    for pool in upstream_pools:
+        pool.start()
+    # Also writes the rejection summaries, so it runs without the access log too
+    access_log.start()
     logger.info(f"API Gateway listening on port {PORT}")
     logger.info(f"Proxying to services:")
     logger.info(f"  - Users: {USER_SERVICE}")
@@ -206,11 +926,13 @@ async def startup_event():
 
 @app.on_event("shutdown")
 async def shutdown_event():
-    """Close HTTP client on shutdown"""
-    await client.aclose()
+    """Close upstream HTTP clients and flush the access log on shutdown"""
+    for pool in upstream_pools:
+        await pool.aclose()
+    await access_log.stop()
 
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=PORT)
+    uvicorn.run(app, host="0.0.0.0", port=PORT, access_log=False)
 
@@ -0,0 +1,226 @@
+"""
+Upstream connection pools for the API Gateway
+Each upstream service gets its own httpx client so a slow service cannot
+exhaust the connections used to reach the others
+"""
+
+import os
+import time
+from collections import deque
+
+import httpx
+
+from balancer import BalancingTransport, EndpointSet
+
+
+def env_int(name: str, default: int) -> int:
+    """Read an integer setting from the environment"""
+    return int(os.getenv(name, str(default)))
+
+
+def env_float(name: str, default: float) -> float:
+    """Read a float setting from the environment"""
+    return float(os.getenv(name, str(default)))
+
+
+def env_bool(name: str, default: bool) -> bool:
+    """Read a boolean setting from the environment"""
+    return os.getenv(name, str(default)).strip().lower() in ("1", "true", "yes", "on")
+
+
+# httpcore trace events that mean a connection has been handed to the request
+CONNECTION_ACQUIRED_EVENTS = frozenset({
+    "connection.connect_tcp.started",
+    "connection.connect_unix_socket.started",
+    "http11.send_request_headers.started",
+    "http2.send_connection_init.started",
+    "http2.send_request_headers.started",
+})
+
+# Number of recent pool wait samples kept for percentile reporting
+WAIT_SAMPLE_SIZE = 1024
+
+
+class PoolStats:
+    """Occupancy and connection wait time for one upstream pool"""
+
+    def __init__(self, max_connections: int):
+        self.max_connections = max_connections
+        self.requests = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.pool_timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.wait_samples = deque(maxlen=WAIT_SAMPLE_SIZE)
+
+    def record_wait(self, seconds: float):
+        self.wait_total += seconds
+        self.wait_max = max(self.wait_max, seconds)
+        self.wait_samples.append(seconds)
+
+    def snapshot(self) -> dict:
+        samples = sorted(self.wait_samples)
+
+        def percentile(p: float) -> float:
+            if not samples:
+                return 0.0
+            return round(samples[min(len(samples) - 1, int(len(samples) * p))] * 1000, 3)
+
+        return {
+            "max_connections": self.max_connections,
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "utilization": round(self.in_flight / self.max_connections, 3),
+            "requests": self.requests,
+            "pool_timeouts": self.pool_timeouts,
+            "wait_ms": {
+                "avg": round(self.wait_total / self.requests * 1000, 3) if self.requests else 0.0,
+                "max": round(self.wait_max * 1000, 3),
+                "p50": percentile(0.50),
+                "p95": percentile(0.95),
+                "p99": percentile(0.99),
+            },
+        }
+
+
+class TrackedStream(httpx.AsyncByteStream):
+    """Response stream that releases its in-flight slot once closed"""
+
+    def __init__(self, stream: httpx.AsyncByteStream, stats: PoolStats):
+        self.stream = stream
+        self.stats = stats
+        self.closed = False
+
+    async def __aiter__(self):
+        async for chunk in self.stream:
+            yield chunk
+
+    async def aclose(self):
+        if not self.closed:
+            self.closed = True
+            self.stats.in_flight -= 1
+        await self.stream.aclose()
+
+
+class InstrumentedTransport(httpx.AsyncBaseTransport):
+    """Transport wrapper that measures pool occupancy and connection wait time"""
+
+    def __init__(self, transport: httpx.AsyncHTTPTransport, stats: PoolStats):
+        self.transport = transport
+        self.stats = stats
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        stats = self.stats
+        started = time.perf_counter()
+        acquired = False
+        previous_trace = request.extensions.get("trace")
+
+        async def trace(event_name: str, info: dict):
+            nonlocal acquired
+            if not acquired and event_name in CONNECTION_ACQUIRED_EVENTS:
+                acquired = True
+                stats.record_wait(time.perf_counter() - started)
+            if previous_trace is not None:
+                await previous_trace(event_name, info)
+
+        request.extensions = {**request.extensions, "trace": trace}
+        stats.requests += 1
+        stats.in_flight += 1
+        stats.peak_in_flight = max(stats.peak_in_flight, stats.in_flight)
+
+        try:
+            response = await self.transport.handle_async_request(request)
+        except BaseException as e:
+            stats.in_flight -= 1
+            if isinstance(e, httpx.PoolTimeout):
+                stats.pool_timeouts += 1
+            raise
+
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=TrackedStream(response.stream, stats),
+            extensions=response.extensions,
+        )
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+class UpstreamPool:
+    """
+    Dedicated HTTP client for one upstream service
+
+    Settings are read from the environment using the service prefix, e.g.
+    PRODUCT_SERVICE_MAX_CONNECTIONS, PRODUCT_SERVICE_KEEPALIVE_EXPIRY,
+    PRODUCT_SERVICE_CONNECT_TIMEOUT, PRODUCT_SERVICE_READ_TIMEOUT,
+    PRODUCT_SERVICE_POOL_TIMEOUT and PRODUCT_SERVICE_HTTP2.
+
+    Replicas are listed in PRODUCT_SERVICE_ENDPOINTS or resolved from the
+    host in PRODUCT_SERVICE_DNS (refreshed every PRODUCT_SERVICE_DNS_REFRESH
+    seconds), with passive ejection tuned by PRODUCT_SERVICE_EJECT_AFTER and
+    PRODUCT_SERVICE_EJECT_SECONDS. Requests keep using base_url; the
+    transport rewrites each one to the replica it picks.
+    """
+
+    def __init__(self, name: str, base_url: str, read_timeout: float = 60.0):
+        self.name = name
+        self.base_url = base_url
+        self.max_connections = env_int(f"{name}_MAX_CONNECTIONS", 100)
+        self.max_keepalive = env_int(f"{name}_MAX_KEEPALIVE", 20)
+        self.keepalive_expiry = env_float(f"{name}_KEEPALIVE_EXPIRY", 5.0)
+        self.http2 = env_bool(f"{name}_HTTP2", False)
+        self.timeout = httpx.Timeout(
+            connect=env_float(f"{name}_CONNECT_TIMEOUT", 5.0),
+            read=env_float(f"{name}_READ_TIMEOUT", read_timeout),
+            write=env_float(f"{name}_WRITE_TIMEOUT", read_timeout),
+            pool=env_float(f"{name}_POOL_TIMEOUT", 5.0),
+        )
+        self.stats = PoolStats(self.max_connections)
+        self.endpoints = EndpointSet(
+            base_url,
+            endpoints=os.getenv(f"{name}_ENDPOINTS"),
+            dns_name=os.getenv(f"{name}_DNS"),
+            dns_refresh=env_float(f"{name}_DNS_REFRESH", 10.0),
+            eject_after=env_int(f"{name}_EJECT_AFTER", 5),
+            eject_seconds=env_float(f"{name}_EJECT_SECONDS", 10.0),
+        )
+        transport = httpx.AsyncHTTPTransport(
+            http2=self.http2,
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_keepalive,
+                keepalive_expiry=self.keepalive_expiry,
+            ),
+        )
+        self.client = httpx.AsyncClient(
+            transport=BalancingTransport(
+                InstrumentedTransport(transport, self.stats), self.endpoints
+            ),
+            timeout=self.timeout,
+            follow_redirects=True,
+        )
+
+    def start(self):
+        """Start background DNS refresh, if configured"""
+        self.endpoints.start()
+
+    async def aclose(self):
+        await self.endpoints.stop()
+        await self.client.aclose()
+
+    def snapshot(self) -> dict:
+        return {
+            "url": self.base_url,
+            "http2": self.http2,
+            "keepalive_expiry": self.keepalive_expiry,
+            "max_keepalive_connections": self.max_keepalive,
+            "timeouts": {
+                "connect": self.timeout.connect,
+                "read": self.timeout.read,
+                "pool": self.timeout.pool,
+            },
+            **self.stats.snapshot(),
+            "balancing": self.endpoints.snapshot(),
+        }
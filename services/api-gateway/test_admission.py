@@ -0,0 +1,164 @@
+import asyncio
+import math
+import random
+
+import pytest
+
+import admission
+from admission import AdaptiveLimit, AdmissionController, Overloaded, RouteClass
+
+
+class FakeTime:
+    """Stands in for the time module so round trips take simulated time"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeTime()
+    monkeypatch.setattr(admission, "time", fake)
+    return fake
+
+
+def run(limiter, clock, latencies, failed=False):
+    """Feed samples as a saturated route would, returning the lowest limit seen"""
+    lowest = limiter.limit
+    for rtt in latencies:
+        clock.now += rtt / max(limiter.limit, 1)
+        limiter.update(rtt, failed, int(limiter.limit))
+        lowest = min(lowest, limiter.limit)
+    return lowest
+
+
+def lognormal(median, sigma, count, seed=1):
+    rng = random.Random(seed)
+    return [rng.lognormvariate(math.log(median), sigma) for _ in range(count)]
+
+
+def test_jittery_healthy_latency_holds_limit(clock):
+    """Ordinary latency variation on a healthy upstream does not cut the limit"""
+    limiter = AdaptiveLimit(initial=50, min_limit=5, max_limit=500)
+    lowest = run(limiter, clock, lognormal(0.02, 0.5, 5000))
+    assert lowest >= 45
+    assert limiter.limit >= 50
+
+
+def test_bimodal_healthy_latency_holds_limit(clock):
+    """A mix of fast and slow responses is not mistaken for overload"""
+    rng = random.Random(2)
+    limiter = AdaptiveLimit(initial=50, min_limit=5, max_limit=500)
+    lowest = run(limiter, clock, [rng.choice((0.002, 0.04)) for _ in range(5000)])
+    assert lowest >= 45
+
+
+def test_sustained_slowdown_cuts_limit(clock):
+    """Latency well above the baseline scales the limit down"""
+    limiter = AdaptiveLimit(initial=50, min_limit=5, max_limit=500)
+    run(limiter, clock, lognormal(0.02, 0.3, 2000))
+    before = limiter.limit
+    run(limiter, clock, lognormal(0.1, 0.3, 200, seed=3))
+    assert limiter.limit <= before * 0.5
+
+
+def test_decrease_at_most_once_per_round_trip(clock):
+    """A burst of slow samples within one round trip cuts the limit once"""
+    limiter = AdaptiveLimit(initial=50, min_limit=5, max_limit=500, short_window=1)
+    limiter.update(0.01, False, 0)
+    limiter.update(0.1, False, 0)
+    after_first = limiter.limit
+    limiter.update(0.1, False, 0)
+    assert after_first < 50
+    assert limiter.limit == after_first
+
+
+def test_failures_back_off_to_min_limit(clock):
+    limiter = AdaptiveLimit(initial=50, min_limit=5, max_limit=500)
+    run(limiter, clock, [0.02] * 2000, failed=True)
+    assert limiter.limit == 5
+
+
+def test_limit_grows_only_while_used(clock):
+    limiter = AdaptiveLimit(initial=10, min_limit=5, max_limit=500)
+    for _ in range(100):
+        limiter.update(0.02, False, 1)
+    assert limiter.limit == 10
+
+    run(limiter, clock, [0.02] * 100)
+    assert limiter.limit > 10
+
+
+def test_limit_capped_at_max(clock):
+    limiter = AdaptiveLimit(initial=10, min_limit=5, max_limit=12)
+    run(limiter, clock, [0.02] * 1000)
+    assert limiter.limit == 12
+
+
+def route_class(name, priority, max_queue=1, queue_timeout=1.0):
+    route = RouteClass(name, priority, [f"/api/{name}"], 1.0, max_queue, queue_timeout)
+    route.limiter.limit = 1.0
+    return route
+
+
+def test_full_queue_sheds_with_429():
+    async def scenario():
+        controller = AdmissionController(global_limit=10)
+        browse = route_class("browse", 1)
+        controller.add_class(browse)
+        await controller.acquire(browse)
+        waiting = asyncio.ensure_future(controller.acquire(browse))
+        await asyncio.sleep(0)
+        with pytest.raises(Overloaded) as shed:
+            await controller.acquire(browse)
+        waiting.cancel()
+        return shed.value
+
+    shed = asyncio.run(scenario())
+    assert shed.status_code == 429
+    assert shed.reason == "queue full"
+
+
+def test_queue_timeout_sheds_with_503():
+    async def scenario():
+        controller = AdmissionController(global_limit=10)
+        browse = route_class("browse", 1, queue_timeout=0.01)
+        controller.add_class(browse)
+        await controller.acquire(browse)
+        with pytest.raises(Overloaded) as shed:
+            await controller.acquire(browse)
+        return shed.value, browse
+
+    shed, browse = asyncio.run(scenario())
+    assert shed.status_code == 503
+    assert browse.shed_timeout == 1
+    assert not browse.queue
+
+
+def test_release_admits_higher_priority_first():
+    async def scenario():
+        controller = AdmissionController(global_limit=1)
+        checkout = route_class("checkout", 0)
+        browse = route_class("browse", 1)
+        checkout.limiter.limit = browse.limiter.limit = 10.0
+        controller.add_class(browse)
+        controller.add_class(checkout)
+        await controller.acquire(browse)
+        order = []
+
+        async def wait(route):
+            await controller.acquire(route)
+            order.append(route.name)
+
+        waiters = [asyncio.ensure_future(wait(browse)), asyncio.ensure_future(wait(checkout))]
+        await asyncio.sleep(0)
+        controller.release(browse, None, False)
+        await asyncio.sleep(0)
+        for waiter in waiters:
+            waiter.cancel()
+        return order
+
+    assert asyncio.run(scenario()) == ["checkout"]
@@ -0,0 +1,129 @@
+import pytest
+
+import breaker
+from breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError
+
+
+class FakeTime:
+    """Stands in for the time module so the open period can be skipped"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeTime()
+    monkeypatch.setattr(breaker, "time", fake)
+    return fake
+
+
+@pytest.fixture
+def circuit(monkeypatch, clock):
+    monkeypatch.setenv("TEST_BREAKER_MIN_CALLS", "10")
+    monkeypatch.setenv("TEST_BREAKER_OPEN_SECONDS", "15")
+    monkeypatch.setenv("TEST_BREAKER_HALF_OPEN_CALLS", "2")
+    return CircuitBreaker("TEST", slow_call_seconds=1.0)
+
+
+def call(circuit, duration=0.01, failed=False, times=1):
+    for _ in range(times):
+        circuit.allow()
+        circuit.record(duration, failed)
+
+
+def trip(circuit):
+    call(circuit, failed=True, times=circuit.min_calls)
+    assert circuit.state == OPEN
+
+
+def test_stays_closed_below_min_calls(circuit):
+    call(circuit, failed=True, times=9)
+    assert circuit.state == CLOSED
+
+
+def test_opens_on_failure_rate(circuit):
+    call(circuit, times=5)
+    call(circuit, failed=True, times=5)
+    assert circuit.state == OPEN
+    assert circuit.times_opened == 1
+
+
+def test_stays_closed_below_failure_rate(circuit):
+    call(circuit, times=6)
+    call(circuit, failed=True, times=4)
+    assert circuit.state == CLOSED
+
+
+def test_opens_on_slow_call_rate(circuit):
+    call(circuit, times=2)
+    call(circuit, duration=1.5, times=8)
+    assert circuit.state == OPEN
+
+
+def test_old_failures_leave_the_window(circuit, clock):
+    call(circuit, failed=True, times=9)
+    clock.now += circuit.window.seconds
+    call(circuit, times=10)
+    assert circuit.state == CLOSED
+
+
+def test_open_circuit_rejects_with_retry_after(circuit, clock):
+    trip(circuit)
+    clock.now += 5
+    with pytest.raises(CircuitOpenError) as rejected:
+        circuit.allow()
+    assert rejected.value.name == "TEST"
+    assert rejected.value.retry_after == 10
+    assert circuit.rejected == 1
+
+
+def test_half_open_after_open_seconds(circuit, clock):
+    trip(circuit)
+    clock.now += 15
+    circuit.allow()
+    assert circuit.state == HALF_OPEN
+    circuit.allow()
+    # Only half_open_calls probes are let through at once
+    with pytest.raises(CircuitOpenError):
+        circuit.allow()
+
+
+def test_successful_probes_close_the_circuit(circuit, clock):
+    trip(circuit)
+    clock.now += 15
+    call(circuit)
+    assert circuit.state == HALF_OPEN
+    call(circuit)
+    assert circuit.state == CLOSED
+    assert circuit.window.totals() == (0, 0, 0)
+
+
+def test_failed_probe_reopens_the_circuit(circuit, clock):
+    trip(circuit)
+    clock.now += 15
+    call(circuit, failed=True)
+    assert circuit.state == OPEN
+    assert circuit.opened_at == clock.now
+    with pytest.raises(CircuitOpenError):
+        circuit.allow()
+
+
+def test_slow_probe_reopens_the_circuit(circuit, clock):
+    trip(circuit)
+    clock.now += 15
+    call(circuit, duration=2.0)
+    assert circuit.state == OPEN
+
+
+def test_released_probe_slot_can_be_reused(circuit, clock):
+    trip(circuit)
+    clock.now += 15
+    circuit.allow()
+    circuit.allow()
+    circuit.release()
+    circuit.allow()
+    assert circuit.probes_started == 2
@@ -0,0 +1,236 @@
+import httpx
+import pytest
+
+import cache as cache_module
+from cache import CacheEntry, ResponseCache, etag_matches, parse_cache_control
+
+
+class FakeTime:
+    """Stands in for the time module so entries can be aged"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+def make_cache(**kwargs):
+    return ResponseCache(
+        max_bytes=kwargs.pop("max_bytes", 1 << 20),
+        max_entry_bytes=kwargs.pop("max_entry_bytes", 1 << 16),
+        route_ttls={"/api/products": 30.0},
+        **kwargs
+    )
+
+
+def entry(body=b'{"price": 1}', ttl=30.0, etag=None):
+    return CacheEntry(200, [("content-type", "application/json")], body, ttl, etag, etag is not None)
+
+
+def key(path, query=""):
+    return (path, query, "identity")
+
+
+def test_fill_started_before_invalidation_is_not_stored():
+    """A GET that was upstream while a write invalidated its path is not cached"""
+    cache = make_cache()
+    generation = cache.generation("/api/products/1")
+    cache.invalidate("/api/products/1")
+    cache.put(key("/api/products/1"), entry(), generation)
+    assert cache.get(key("/api/products/1")) is None
+    assert cache.stale_fills == 1
+
+
+def test_fill_after_invalidation_is_stored():
+    cache = make_cache()
+    cache.invalidate("/api/products/1")
+    generation = cache.generation("/api/products/1")
+    cache.put(key("/api/products/1"), entry(), generation)
+    assert cache.get(key("/api/products/1")) is not None
+
+
+def test_invalidating_another_path_does_not_void_fill():
+    cache = make_cache()
+    generation = cache.generation("/api/products/1")
+    cache.invalidate("/api/products/2")
+    cache.put(key("/api/products/1"), entry(), generation)
+    assert cache.get(key("/api/products/1")) is not None
+
+
+def test_prefix_invalidation_voids_fills_under_it():
+    """A bulk write voids in-flight fills of paths that had nothing cached yet"""
+    cache = make_cache()
+    generation = cache.generation("/api/products/7")
+    other = cache.generation("/api/orders/7")
+    cache.invalidate_prefix("/api/products")
+    cache.put(key("/api/products/7"), entry(), generation)
+    cache.put(key("/api/orders/7"), entry(), other)
+    assert cache.get(key("/api/products/7")) is None
+    assert cache.get(key("/api/orders/7")) is not None
+
+
+def test_untracked_generations_err_towards_not_storing():
+    """Once a path's generation is forgotten, fills from before are refused"""
+    cache = make_cache(max_tracked=2)
+    generation = cache.generation("/api/products/1")
+    cache.invalidate("/api/products/1")
+    cache.invalidate("/api/products/2")
+    cache.invalidate("/api/products/3")
+    assert "/api/products/1" not in cache.invalidated
+    cache.put(key("/api/products/1"), entry(), generation)
+    assert cache.get(key("/api/products/1")) is None
+    assert len(cache.invalidated) == 2
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeTime()
+    monkeypatch.setattr(cache_module, "time", fake)
+    return fake
+
+
+def test_entry_is_fresh_until_its_ttl(clock):
+    stored = entry(ttl=30.0)
+    clock.now += 29.5
+    assert stored.is_fresh()
+    assert stored.age() == 29
+    clock.now += 1
+    assert not stored.is_fresh()
+
+
+def test_refresh_restarts_ttl(clock):
+    stored = entry(ttl=30.0)
+    clock.now += 31
+    stored.refresh(30.0)
+    assert stored.is_fresh()
+    assert stored.age() == 0
+
+
+def test_zero_ttl_entry_is_never_fresh(clock):
+    assert not entry(ttl=0.0).is_fresh()
+
+
+def test_route_ttl_matches_longest_prefix():
+    cache = ResponseCache(1 << 20, 1 << 16, {"/api/products": 30.0, "/api/products/export": 0.0})
+    assert cache.route_ttl("/api/products") == 30.0
+    assert cache.route_ttl("/api/products/42") == 30.0
+    assert cache.route_ttl("/api/products/export") is None
+    assert cache.route_ttl("/api/productsx") is None
+    assert cache.route_ttl("/api/orders/1") is None
+
+
+def test_generated_etag_follows_body():
+    assert entry(b"a").etag == entry(b"a").etag
+    assert entry(b"a").etag != entry(b"b").etag
+    assert entry(etag='"v1"').etag == '"v1"'
+    assert entry(etag='"v1"').upstream_etag
+    assert not entry().upstream_etag
+
+
+def test_etag_matches_weakly():
+    assert etag_matches('"v1"', '"v1"')
+    assert etag_matches('W/"v1"', '"v1"')
+    assert etag_matches('"v1"', 'W/"v1"')
+    assert etag_matches('"v0", "v1"', '"v1"')
+    assert etag_matches("*", '"v1"')
+    assert not etag_matches('"v0"', '"v1"')
+    assert not etag_matches(None, '"v1"')
+    assert not etag_matches('"v1"', None)
+
+
+def test_parse_cache_control():
+    assert parse_cache_control('Public, max-age=60, s-maxage="120", no-cache') == {
+        "public": None, "max-age": "60", "s-maxage": "120", "no-cache": None
+    }
+    assert parse_cache_control(None) == {}
+    assert parse_cache_control(" , ") == {}
+
+
+def storable(response_headers=None, request_headers=None, route_ttl=30.0):
+    return make_cache().storable_ttl(
+        route_ttl, httpx.Headers(request_headers or {}), httpx.Headers(response_headers or {})
+    )
+
+
+def test_storable_ttl_defaults_to_route_ttl():
+    assert storable() == 30.0
+    assert storable({"vary": "Accept-Encoding, Origin"}) == 30.0
+
+
+def test_storable_ttl_is_capped_by_upstream_max_age():
+    assert storable({"cache-control": "max-age=10"}) == 10.0
+    assert storable({"cache-control": "max-age=600"}) == 30.0
+    assert storable({"cache-control": "s-maxage=5, max-age=20"}) == 5.0
+    assert storable({"cache-control": "max-age=soon"}) is None
+
+
+def test_no_store_private_and_vary_are_not_stored():
+    assert storable({"cache-control": "no-store"}) is None
+    assert storable({"cache-control": "private, max-age=60"}) is None
+    assert storable({"vary": "Cookie"}) is None
+
+
+def test_no_cache_is_stored_for_revalidation():
+    assert storable({"cache-control": "no-cache"}) == 0.0
+
+
+def test_authorized_requests_need_explicit_permission():
+    auth = {"authorization": "Bearer t"}
+    assert storable(request_headers=auth) is None
+    assert storable({"cache-control": "public"}, auth) == 30.0
+    assert storable({"cache-control": "s-maxage=10"}, auth) == 10.0
+
+
+def test_invalidate_drops_every_variant_of_a_path():
+    cache = make_cache()
+    cache.put(key("/api/products/1"), entry())
+    cache.put(("/api/products/1", "", "gzip"), entry(b"gz"))
+    cache.put(key("/api/products/2"), entry())
+    cache.invalidate("/api/products/1")
+    assert cache.get(key("/api/products/1")) is None
+    assert cache.get(("/api/products/1", "", "gzip")) is None
+    assert cache.get(key("/api/products/2")) is not None
+    assert cache.invalidations == 2
+    assert "/api/products/1" not in cache.paths
+
+
+def test_invalidate_prefix_drops_paths_under_it_only():
+    cache = make_cache()
+    cache.put(key("/api/products"), entry())
+    cache.put(key("/api/products/1", "fields=name"), entry())
+    cache.put(key("/api/productsx"), entry())
+    cache.invalidate_prefix("/api/products/")
+    assert cache.get(key("/api/products")) is None
+    assert cache.get(key("/api/products/1", "fields=name")) is None
+    assert cache.get(key("/api/productsx")) is not None
+
+
+def test_evicts_least_recently_used_by_bytes():
+    body = b"x" * 100
+    size = entry(body).size
+    cache = make_cache(max_bytes=size * 2)
+    cache.put(key("/a"), entry(body))
+    cache.put(key("/b"), entry(body))
+    cache.get(key("/a"))
+    cache.put(key("/c"), entry(body))
+    assert cache.get(key("/b")) is None
+    assert cache.get(key("/a")) is not None
+    assert cache.get(key("/c")) is not None
+    assert cache.bytes == size * 2
+    assert cache.evictions == 1
+
+
+def test_oversized_entry_is_not_stored():
+    cache = make_cache(max_entry_bytes=10)
+    cache.put(key("/a"), entry(b"x" * 100))
+    assert cache.get(key("/a")) is None
+    assert cache.bytes == 0
+
+
+def test_replacing_an_entry_keeps_byte_count():
+    cache = make_cache()
+    cache.put(key("/a"), entry(b"x" * 100))
+    cache.put(key("/a"), entry(b"y" * 10))
+    assert cache.bytes == entry(b"y" * 10).size
+    assert len(cache.entries) == 1
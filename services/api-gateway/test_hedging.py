@@ -0,0 +1,107 @@
+import asyncio
+
+import httpx
+
+from balancer import BalancingTransport, EndpointSet
+from hedging import HedgingPolicy, route_template, send_with_retries
+
+
+def hedging_policy(monkeypatch, route_samples=()):
+    monkeypatch.setenv("TEST_HEDGING", "true")
+    policy = HedgingPolicy("TEST")
+    for route, seconds in route_samples:
+        for _ in range(100):
+            policy.latency(route).record(seconds)
+    return policy
+
+
+def test_route_template_collapses_ids():
+    assert route_template("GET", "/api/products/42") == "GET /api/products/{id}"
+    assert route_template("GET", "/api/products/") == "GET /api/products"
+    assert route_template("GET", "/api/products/facets") == "GET /api/products/facets"
+    assert route_template("GET", "/api/orders/7/details") == "GET /api/orders/{id}/details"
+    assert (
+        route_template("GET", "/api/users/550e8400-e29b-41d4-a716-446655440000")
+        == "GET /api/users/{id}"
+    )
+
+
+def test_hedge_delay_is_per_route(monkeypatch):
+    policy = hedging_policy(monkeypatch, [
+        ("GET /api/products/{id}", 0.02),
+        ("GET /api/products/export", 2.0),
+    ])
+    assert policy.hedge_delay("GET /api/products/{id}") == 0.02
+    assert policy.hedge_delay("GET /api/products/export") == 2.0
+    assert policy.hedge_delay("GET /api/products") is None
+
+
+def test_routes_beyond_max_share_one_tracker(monkeypatch):
+    monkeypatch.setenv("TEST_HEDGING_MAX_ROUTES", "2")
+    policy = hedging_policy(monkeypatch)
+    policy.latency("GET /a")
+    policy.latency("GET /b")
+    assert policy.latency("GET /c") is policy.latency("GET /d")
+    assert len(policy.latencies) == 3
+
+
+def make_client(endpoints, delays):
+    """Client balancing over endpoints, each answering after its delay"""
+    seen = []
+
+    async def handler(request):
+        seen.append(request.url.host)
+        await asyncio.sleep(delays[request.url.host])
+        return httpx.Response(200, text=request.url.host)
+
+    endpoint_set = EndpointSet("http://upstream:80", endpoints=endpoints)
+    transport = BalancingTransport(httpx.MockTransport(handler), endpoint_set)
+    return httpx.AsyncClient(transport=transport), endpoint_set, seen
+
+
+def test_hedge_goes_to_another_replica(monkeypatch):
+    policy = hedging_policy(monkeypatch, [("GET /slow", 0.01)])
+
+    async def scenario():
+        client, endpoints, seen = make_client("http://a:80,http://b:80", {"a": 0.5, "b": 0.5})
+        # Keep the primary on replica a by making b look busy
+        endpoints.endpoints[1].outstanding = 100
+
+        async def send(routing):
+            return await client.get("http://upstream/slow", extensions={"routing": routing})
+
+        task = asyncio.ensure_future(send_with_retries(send, policy, "GET /slow", len(endpoints.endpoints)))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        await client.aclose()
+        return seen
+
+    assert asyncio.run(scenario()) == ["a", "b"]
+    assert policy.hedges == 1
+
+
+def test_no_hedge_with_a_single_replica(monkeypatch):
+    policy = hedging_policy(monkeypatch, [("GET /slow", 0.01)])
+
+    async def scenario():
+        client, endpoints, seen = make_client(None, {"upstream": 0.05})
+
+        async def send(routing):
+            return await client.get("http://upstream/slow", extensions={"routing": routing})
+
+        response = await send_with_retries(send, policy, "GET /slow", len(endpoints.endpoints))
+        await client.aclose()
+        return response, seen
+
+    response, seen = asyncio.run(scenario())
+    assert response.status_code == 200
+    assert seen == ["upstream"]
+    assert policy.hedges == 0
+
+
+def test_choose_avoids_excluded_replica():
+    endpoints = EndpointSet("http://upstream:80", endpoints="http://a:80,http://b:80")
+    first, second = endpoints.endpoints
+    assert all(endpoints.choose(exclude=first) is second for _ in range(20))
+    single = EndpointSet("http://upstream:80")
+    assert single.choose(exclude=single.endpoints[0]) is single.endpoints[0]
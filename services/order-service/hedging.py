@@ -0,0 +1,252 @@
+"""
+Hedged requests and retry budgets for the Order Service
+Idempotent calls to other services may be retried or hedged, but only while
+that service's retry budget has tokens, so retries cannot amplify an outage
+"""
+
+import asyncio
+import os
+import re
+import time
+from collections import deque
+from typing import Awaitable, Callable, Dict, Optional
+
+import httpx
+
+
+def env_int(name: str, default: int) -> int:
+    """Read an integer setting from the environment"""
+    return int(os.getenv(name, str(default)))
+
+
+def env_float(name: str, default: float) -> float:
+    """Read a float setting from the environment"""
+    return float(os.getenv(name, str(default)))
+
+
+def env_bool(name: str, default: bool) -> bool:
+    """Read a boolean setting from the environment"""
+    return os.getenv(name, str(default)).strip().lower() in ("1", "true", "yes", "on")
+
+
+# Upstream statuses worth retrying an idempotent request for
+RETRYABLE_STATUSES = frozenset({502, 503, 504})
+
+# Path segments that identify a resource rather than a route: integers,
+# UUIDs and hex object ids
+ID_SEGMENT = re.compile(
+    r"^(\d+"
+    r"|[0-9a-fA-F]{8}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{12}"
+    r"|[0-9a-fA-F]{24})$"
+)
+
+# Latency tracker shared by routes beyond a policy's max_routes
+OTHER_ROUTES = "*"
+
+
+def route_template(method: str, path: str) -> str:
+    """Method and path with resource ids collapsed, e.g. GET /api/products/{id}"""
+    segments = ["{id}" if ID_SEGMENT.match(segment) else segment for segment in path.rstrip("/").split("/")]
+    return f"{method} {'/'.join(segments) or '/'}"
+
+
+class RetryBudget:
+    """
+    Token bucket for retries and hedges
+
+    Every original request deposits `ratio` tokens (so retries are capped at
+    roughly that fraction of traffic) and a floor of `min_per_second` tokens
+    is refilled over time so low-traffic upstreams can still retry.
+    """
+
+    def __init__(self, ratio: float, min_per_second: float, max_tokens: float):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self.updated = time.monotonic()
+        self.exhausted = 0
+
+    def deposit(self):
+        self.refill()
+        self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        self.refill()
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return True
+        self.exhausted += 1
+        return False
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.max_tokens, self.tokens + (now - self.updated) * self.min_per_second)
+        self.updated = now
+
+
+class LatencyTracker:
+    """Recent response latencies, with the percentile recomputed every few samples"""
+
+    def __init__(self, size: int = 1000, refresh_every: int = 50, min_samples: int = 100):
+        self.samples = deque(maxlen=size)
+        self.refresh_every = refresh_every
+        self.min_samples = min_samples
+        self.since_refresh = 0
+        self.p95: Optional[float] = None
+
+    def record(self, seconds: float):
+        self.samples.append(seconds)
+        self.since_refresh += 1
+        if self.since_refresh >= self.refresh_every and len(self.samples) >= self.min_samples:
+            ordered = sorted(self.samples)
+            self.p95 = ordered[int(len(ordered) * 0.95) - 1]
+            self.since_refresh = 0
+
+
+class HedgingPolicy:
+    """
+    Retry and hedging settings and counters for one service, read from
+    <NAME>_HEDGING, <NAME>_MAX_RETRIES and <NAME>_RETRY_BUDGET_* variables
+
+    Latency is tracked per route template, so fast lookups and slow
+    listings or exports each hedge after their own p95.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.hedging = env_bool(f"{name}_HEDGING", False)
+        self.min_hedge_delay = env_float(f"{name}_MIN_HEDGE_DELAY", 0.01)
+        self.max_retries = env_int(f"{name}_MAX_RETRIES", 1)
+        self.budget = RetryBudget(
+            ratio=env_float(f"{name}_RETRY_BUDGET_RATIO", 0.1),
+            min_per_second=env_float(f"{name}_RETRY_BUDGET_MIN_PER_SECOND", 1.0),
+            max_tokens=env_float(f"{name}_RETRY_BUDGET_MAX_TOKENS", 20.0),
+        )
+        self.max_routes = env_int(f"{name}_HEDGING_MAX_ROUTES", 256)
+        self.latencies: Dict[str, LatencyTracker] = {}
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.primary_wins = 0
+
+    def latency(self, route: str) -> LatencyTracker:
+        tracker = self.latencies.get(route)
+        if tracker is None:
+            if len(self.latencies) >= self.max_routes:
+                route = OTHER_ROUTES
+            tracker = self.latencies.setdefault(route, LatencyTracker())
+        return tracker
+
+    def hedge_delay(self, route: str) -> Optional[float]:
+        p95 = self.latency(route).p95 if self.hedging else None
+        if p95 is None:
+            return None
+        return max(self.min_hedge_delay, p95)
+
+    def stats(self) -> dict:
+        return {
+            "hedging": self.hedging,
+            "hedge_delays_ms": {
+                route: round(max(self.min_hedge_delay, tracker.p95) * 1000, 3)
+                for route, tracker in self.latencies.items() if tracker.p95 is not None
+            },
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "primary_wins": self.primary_wins,
+            "retries": self.retries,
+            "budget_tokens": round(self.budget.tokens, 2),
+            "budget_exhausted": self.budget.exhausted,
+        }
+
+
+async def discard(task: asyncio.Task):
+    """Cancel a losing attempt, closing its response if it already arrived"""
+    if not task.done():
+        task.cancel()
+        return
+    if not task.cancelled() and task.exception() is None:
+        await task.result().aclose()
+
+
+async def send_hedged(
+    send: Callable[[dict], Awaitable[httpx.Response]],
+    policy: HedgingPolicy,
+    route: str,
+    replicas: int
+) -> httpx.Response:
+    """
+    Send an idempotent request; if it has not answered within the route's
+    p95 latency, send a second copy to another replica and return whichever
+    answers first
+
+    send takes a routing dict: the balancer records the replica it chose
+    under "endpoint" and avoids the one under "exclude". With a single
+    replica there is nowhere else to send a hedge, so none is sent.
+    """
+    started = time.perf_counter()
+    routing: dict = {}
+    primary = asyncio.ensure_future(send(routing))
+    attempts = [primary]
+    try:
+        delay = policy.hedge_delay(route) if replicas > 1 else None
+        if delay is not None:
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            if not done and policy.budget.withdraw():
+                policy.hedges += 1
+                attempts.append(asyncio.ensure_future(send({"exclude": routing.get("endpoint")})))
+
+        pending = set(attempts)
+        while True:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            winner = next((t for t in done if t.exception() is None), None)
+            if winner is not None or not pending:
+                break
+        if winner is None:
+            # Every attempt failed; surface the primary's error
+            raise primary.exception()
+
+        policy.latency(route).record(time.perf_counter() - started)
+        if len(attempts) > 1:
+            if winner is primary:
+                policy.primary_wins += 1
+            else:
+                policy.hedge_wins += 1
+        attempts.remove(winner)
+        return winner.result()
+    finally:
+        for attempt in attempts:
+            await discard(attempt)
+
+
+async def send_with_retries(
+    send: Callable[[dict], Awaitable[httpx.Response]],
+    policy: HedgingPolicy,
+    route: str,
+    replicas: int = 1
+) -> httpx.Response:
+    """
+    Send an idempotent request (hedged when enabled), retrying connection
+    failures and 502/503/504 responses while the retry budget allows
+    """
+    retries = 0
+    while True:
+        try:
+            response = await send_hedged(send, policy, route, replicas)
+        except (httpx.ConnectError, httpx.ConnectTimeout):
+            if retries < policy.max_retries and policy.budget.withdraw():
+                retries += 1
+                policy.retries += 1
+                continue
+            raise
+
+        if (
+            response.status_code in RETRYABLE_STATUSES
+            and retries < policy.max_retries
+            and policy.budget.withdraw()
+        ):
+            await response.aclose()
+            retries += 1
+            policy.retries += 1
+            continue
+        return response
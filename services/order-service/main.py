@@ -3,16 +3,21 @@ Order Service - Python/FastAPI Implementation
 Handles order processing and management
 """
 
-from fastapi import FastAPI, HTTPException, Depends, Header
+from fastapi import FastAPI, HTTPException, Depends, Header, Request
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import Optional, List, Dict
 import os
+import asyncio
 import asyncpg
 import httpx
 from datetime import datetime
 import logging
 
+from gateway_identity import verify_gateway_identity
+from hedging import HedgingPolicy, route_template, send_with_retries
+from serialization import json_response, raw_json, row_serializer
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -42,12 +47,26 @@ USER_SERVICE_URL = os.getenv("USER_SERVICE_URL", "http://user-service:3001")
 PAYMENT_SERVICE_URL = os.getenv("PAYMENT_SERVICE_URL", "http://payment-service:3004")
 INVENTORY_SERVICE_URL = os.getenv("INVENTORY_SERVICE_URL", "http://inventory-service:3005")
 
+# Trust identity headers signed by the API gateway instead of calling User Service
+TRUST_GATEWAY_IDENTITY = os.getenv("TRUST_GATEWAY_IDENTITY", "false").lower() == "true"
+GATEWAY_IDENTITY_SECRET = os.getenv(
+    "GATEWAY_IDENTITY_SECRET",
+    os.getenv("JWT_SECRET", "your-secret-key-change-in-production")
+)
+
 # Database connection pool
 db_pool: Optional[asyncpg.Pool] = None
 
 # HTTP client for service-to-service communication
 http_client = httpx.AsyncClient(timeout=30.0)
 
+# Retry budgets per service, so one slow or failing service cannot spend
+# another's retries
+hedging_policies = {name: HedgingPolicy(name) for name in ("USER_SERVICE", "PRODUCT_SERVICE")}
+
+# Most product ids per Product Service bulk lookup (its MAX_BATCH_SIZE)
+PRODUCT_BATCH_SIZE = int(os.getenv("PRODUCT_BATCH_SIZE", "100"))
+
 
 # Pydantic Models
 class OrderItem(BaseModel):
@@ -64,6 +83,48 @@ class OrderStatusUpdate(BaseModel):
     status: str
 
 
+# Response serializers, compiled once per column set
+ORDER_FIELDS = ("id", "user_id", "status", "total_amount", "shipping_address", "created_at", "updated_at")
+ITEM_FIELDS = ("id", "product_id", "quantity", "price")
+serialize_order = row_serializer(ORDER_FIELDS, frozenset({"total_amount"}))
+serialize_item = row_serializer(ITEM_FIELDS, frozenset({"price"}))
+
+
+async def resilient_get(service: str, url: str, **kwargs) -> httpx.Response:
+    """
+    Idempotent GET to another service, retrying connection failures and
+    502/503/504 responses while its budget allows
+
+    Each service is reached through one Service URL, so there is no other
+    replica to hedge to and send_with_retries sends no hedges.
+    """
+    policy = hedging_policies[service]
+    policy.budget.deposit()
+    route = route_template("GET", httpx.URL(url).path)
+    return await send_with_retries(lambda routing: http_client.get(url, **kwargs), policy, route)
+
+
+async def fetch_products(product_ids: List[int]) -> Dict[int, dict]:
+    """
+    Products by id from Product Service's bulk lookup, in batches sent
+    concurrently; ids that do not exist are absent from the result
+    """
+    batches = [
+        product_ids[i:i + PRODUCT_BATCH_SIZE]
+        for i in range(0, len(product_ids), PRODUCT_BATCH_SIZE)
+    ]
+    responses = await asyncio.gather(*(
+        resilient_get("PRODUCT_SERVICE", f"{PRODUCT_SERVICE_URL}/batch", params={"ids": ",".join(map(str, batch))})
+        for batch in batches
+    ))
+    products = {}
+    for response in responses:
+        response.raise_for_status()
+        for product_id, product in response.json()["products"].items():
+            products[int(product_id)] = product
+    return products
+
+
 # Database initialization
 async def init_db():
     """Initialize database tables"""
@@ -99,11 +160,17 @@ async def init_db():
         logger.error(f"Database initialization error: {e}")
 
 
-async def verify_user_token(authorization: str) -> Dict:
-    """Verify user token by calling User Service"""
+async def verify_user_token(authorization: str, headers=None) -> Dict:
+    """Verify user token, trusting gateway identity headers when enabled"""
+    if TRUST_GATEWAY_IDENTITY and headers is not None:
+        user = verify_gateway_identity(headers, GATEWAY_IDENTITY_SECRET)
+        if user:
+            return user
+    
+    # Fall back to calling User Service
     try:
         headers = {"Authorization": authorization}
-        response = await http_client.get(f"{USER_SERVICE_URL}/profile", headers=headers)
+        response = await resilient_get("USER_SERVICE", f"{USER_SERVICE_URL}/profile", headers=headers)
         if response.status_code == 200:
             data = response.json()
             return {
@@ -135,12 +202,18 @@ async def shutdown():
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
-    return {"status": "ok", "service": "order-service", "language": "Python", "framework": "FastAPI"}
+    return {
+        "status": "ok",
+        "service": "order-service",
+        "language": "Python",
+        "framework": "FastAPI",
+        "http_client": {name: policy.stats() for name, policy in hedging_policies.items()}
+    }
 
 
 # Get all orders for a user
 @app.get("/", response_model=dict)
-async def get_orders(authorization: str = Header(None)):
+async def get_orders(request: Request, authorization: str = Header(None)):
     """Get all orders for the authenticated user"""
     if not authorization or not authorization.startswith("Bearer "):
         raise HTTPException(status_code=401, detail="Unauthorized")
@@ -148,7 +221,7 @@ async def get_orders(authorization: str = Header(None)):
     if not db_pool:
         raise HTTPException(status_code=503, detail="Database not initialized")
     
-    user = await verify_user_token(authorization)
+    user = await verify_user_token(authorization, request.headers)
     if not user:
         raise HTTPException(status_code=401, detail="Invalid token")
     
@@ -174,21 +247,12 @@ async def get_orders(authorization: str = Header(None)):
                 ORDER BY o.created_at DESC
             """, user["userId"])
             
-            return {
+            return json_response({
                 "orders": [
-                    {
-                        "id": o["id"],
-                        "user_id": o["user_id"],
-                        "status": o["status"],
-                        "total_amount": float(o["total_amount"]),
-                        "shipping_address": o["shipping_address"],
-                        "items": o["items"],
-                        "created_at": o["created_at"].isoformat(),
-                        "updated_at": o["updated_at"].isoformat()
-                    }
+                    {**serialize_order(o), "items": raw_json(o["items"])}
                     for o in orders
                 ]
-            }
+            })
     
     except Exception as e:
         logger.error(f"Get orders error: {e}")
@@ -197,7 +261,7 @@ async def get_orders(authorization: str = Header(None)):
 
 # Get order by ID
 @app.get("/{order_id}", response_model=dict)
-async def get_order(order_id: int, authorization: str = Header(None)):
+async def get_order(order_id: int, request: Request, authorization: str = Header(None)):
     """Get a specific order by ID"""
     if not authorization or not authorization.startswith("Bearer "):
         raise HTTPException(status_code=401, detail="Unauthorized")
@@ -205,7 +269,7 @@ async def get_order(order_id: int, authorization: str = Header(None)):
     if not db_pool:
         raise HTTPException(status_code=503, detail="Database not initialized")
     
-    user = await verify_user_token(authorization)
+    user = await verify_user_token(authorization, request.headers)
     if not user:
         raise HTTPException(status_code=401, detail="Invalid token")
     
@@ -224,26 +288,12 @@ async def get_order(order_id: int, authorization: str = Header(None)):
                 order_id
             )
             
-            return {
+            return json_response({
                 "order": {
-                    "id": order["id"],
-                    "user_id": order["user_id"],
-                    "status": order["status"],
-                    "total_amount": float(order["total_amount"]),
-                    "shipping_address": order["shipping_address"],
-                    "items": [
-                        {
-                            "id": item["id"],
-                            "product_id": item["product_id"],
-                            "quantity": item["quantity"],
-                            "price": float(item["price"])
-                        }
-                        for item in items
-                    ],
-                    "created_at": order["created_at"].isoformat(),
-                    "updated_at": order["updated_at"].isoformat()
+                    **serialize_order(order),
+                    "items": [serialize_item(item) for item in items]
                 }
-            }
+            })
     
     except HTTPException:
         raise
@@ -254,7 +304,7 @@ async def get_order(order_id: int, authorization: str = Header(None)):
 
 # Create new order
 @app.post("/", response_model=dict, status_code=201)
-async def create_order(order_data: OrderCreate, authorization: str = Header(None)):
+async def create_order(order_data: OrderCreate, request: Request, authorization: str = Header(None)):
     """Create a new order"""
     if not authorization or not authorization.startswith("Bearer "):
         raise HTTPException(status_code=401, detail="Unauthorized")
@@ -262,7 +312,7 @@ async def create_order(order_data: OrderCreate, authorization: str = Header(None
     if not db_pool:
         raise HTTPException(status_code=503, detail="Database not initialized")
     
-    user = await verify_user_token(authorization)
+    user = await verify_user_token(authorization, request.headers)
     if not user:
         raise HTTPException(status_code=401, detail="Invalid token")
     
@@ -270,97 +320,96 @@ async def create_order(order_data: OrderCreate, authorization: str = Header(None
         raise HTTPException(status_code=400, detail="Order must contain at least one item")
     
     try:
-        # Validate and fetch product details
-        total_amount = 0.0
-        validated_items = []
-        
+        # Merge lines for the same product, keeping cart order
+        quantities: Dict[int, int] = {}
         for item in order_data.items:
             if item.quantity <= 0:
                 raise HTTPException(status_code=400, detail="Quantity must be greater than 0")
-            
-            # Fetch product from Product Service
-            try:
-                product_response = await http_client.get(
-                    f"{PRODUCT_SERVICE_URL}/{item.product_id}"
+            quantities[item.product_id] = quantities.get(item.product_id, 0) + item.quantity
+        
+        # Fetch every product at once from Product Service
+        try:
+            products = await fetch_products(list(quantities))
+        except Exception as e:
+            logger.error(f"Error fetching products {list(quantities)}: {e}")
+            raise HTTPException(
+                status_code=500,
+                detail=f"Error validating products: {str(e)}"
+            )
+        
+        # Validate and price each line
+        total_amount = 0.0
+        validated_items = []
+        
+        for product_id, quantity in quantities.items():
+            product = products.get(product_id)
+            if product is None:
+                raise HTTPException(
+                    status_code=404,
+                    detail=f"Product {product_id} not found"
                 )
-                
-                if product_response.status_code == 404:
-                    raise HTTPException(
-                        status_code=404,
-                        detail=f"Product {item.product_id} not found"
-                    )
-                
-                product_data = product_response.json()
-                product = product_data["product"]
-                
-                if product["stock_quantity"] < item.quantity:
-                    raise HTTPException(
-                        status_code=400,
-                        detail=f"Insufficient stock for product {product['name']}. Available: {product['stock_quantity']}"
-                    )
-                
-                item_total = float(product["price"]) * item.quantity
-                total_amount += item_total
-                
-                validated_items.append({
-                    "product_id": item.product_id,
-                    "quantity": item.quantity,
-                    "price": float(product["price"])
-                })
             
-            except HTTPException:
-                raise
-            except Exception as e:
-                logger.error(f"Error fetching product {item.product_id}: {e}")
+            if product["stock_quantity"] < quantity:
                 raise HTTPException(
-                    status_code=500,
-                    detail=f"Error validating product {item.product_id}: {str(e)}"
+                    status_code=400,
+                    detail=f"Insufficient stock for product {product['name']}. Available: {product['stock_quantity']}"
                 )
+            
+            item_total = float(product["price"]) * quantity
+            total_amount += item_total
+            
+            validated_items.append({
+                "product_id": product_id,
+                "quantity": quantity,
+                "price": float(product["price"])
+            })
         
-        # Create order in database (transaction)
+        # Create the order and its items in one statement, which is atomic on
+        # its own: no explicit transaction, one round trip
         async with db_pool.acquire() as conn:
-            async with conn.transaction():
-                # Create order
-                order = await conn.fetchrow("""
+            order = await conn.fetchrow("""
+                WITH new_order AS (
                     INSERT INTO orders (user_id, total_amount, shipping_address, status)
                     VALUES ($1, $2, $3, 'pending')
                     RETURNING *
-                """, user["userId"], total_amount, order_data.shipping_address)
-                
-                # Insert order items
-                for item in validated_items:
-                    await conn.execute("""
-                        INSERT INTO order_items (order_id, product_id, quantity, price)
-                        VALUES ($1, $2, $3, $4)
-                    """, order["id"], item["product_id"], item["quantity"], item["price"])
-                
-                # Fetch order items
-                items = await conn.fetch(
-                    "SELECT * FROM order_items WHERE order_id = $1",
-                    order["id"]
+                ),
+                new_items AS (
+                    INSERT INTO order_items (order_id, product_id, quantity, price)
+                    SELECT new_order.id, item.product_id, item.quantity, item.price
+                    FROM new_order,
+                         unnest($4::int[], $5::int[], $6::numeric[]) AS item(product_id, quantity, price)
+                    RETURNING id, product_id, quantity, price
                 )
-                
-                return {
-                    "message": "Order created successfully",
-                    "order": {
-                        "id": order["id"],
-                        "user_id": order["user_id"],
-                        "status": order["status"],
-                        "total_amount": float(order["total_amount"]),
-                        "shipping_address": order["shipping_address"],
-                        "items": [
-                            {
-                                "id": item["id"],
-                                "product_id": item["product_id"],
-                                "quantity": item["quantity"],
-                                "price": float(item["price"])
-                            }
-                            for item in items
-                        ],
-                        "created_at": order["created_at"].isoformat(),
-                        "updated_at": order["updated_at"].isoformat()
-                    }
-                }
+                SELECT new_order.*,
+                       (
+                           SELECT json_agg(
+                               json_build_object(
+                                   'id', new_items.id,
+                                   'product_id', new_items.product_id,
+                                   'quantity', new_items.quantity,
+                                   'price', new_items.price
+                               )
+                               ORDER BY new_items.id
+                           )
+                           FROM new_items
+                       ) AS items
+                FROM new_order
+            """,
+                user["userId"],
+                total_amount,
+                order_data.shipping_address,
+                [item["product_id"] for item in validated_items],
+                [item["quantity"] for item in validated_items],
+                [item["price"] for item in validated_items]
+            )
+        
+        return json_response({
+            "message": "Order created successfully",
+            "order": {
+                **serialize_order(order),
+                "items": raw_json(order["items"])
+            }
+        }, status_code=201)
     
     except HTTPException:
         raise
@@ -374,6 +423,7 @@ async def create_order(order_data: OrderCreate, authorization: str = Header(None
 async def update_order_status(
     order_id: int,
     status_update: OrderStatusUpdate,
+    request: Request,
     authorization: str = Header(None)
 ):
     """Update order status"""
@@ -390,7 +440,7 @@ async def update_order_status(
             detail=f"Invalid status. Must be one of: {', '.join(valid_statuses)}"
         )
     
-    user = await verify_user_token(authorization)
+    user = await verify_user_token(authorization, request.headers)
     if not user:
         raise HTTPException(status_code=401, detail="Invalid token")
     
@@ -406,18 +456,10 @@ async def update_order_status(
             if not order:
                 raise HTTPException(status_code=404, detail="Order not found")
             
-            return {
-                "order": {
-                    "id": order["id"],
-                    "user_id": order["user_id"],
-                    "status": order["status"],
-                    "total_amount": float(order["total_amount"]),
-                    "shipping_address": order["shipping_address"],
-                    "created_at": order["created_at"].isoformat(),
-                    "updated_at": order["updated_at"].isoformat()
-                },
+            return json_response({
+                "order": serialize_order(order),
                 "message": "Order status updated successfully"
-            }
+            })
     
     except HTTPException:
         raise
@@ -0,0 +1,169 @@
+"""
+Bulk product updates for the Product Service
+Streamed patches are validated, merged per product and applied in chunks,
+each with one set-based UPDATE ... FROM unnest(...) in its own transaction
+"""
+
+from decimal import Decimal, InvalidOperation
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Tuple
+
+from catalog_import import MAX_LENGTHS, MAX_PRICE, RowError
+
+# Columns a patch may change; a missing or null field is left as it is
+PATCH_COLUMNS = ("name", "description", "price", "category", "image_url", "stock_quantity")
+PATCH_TYPES = {
+    "name": "text",
+    "description": "text",
+    "price": "numeric",
+    "category": "text",
+    "image_url": "text",
+    "stock_quantity": "int",
+}
+
+_unnest_arrays = ", ".join(
+    f"${position}::{PATCH_TYPES[column]}[]" for position, column in enumerate(PATCH_COLUMNS, start=2)
+)
+_assignments = ", ".join(f"{column} = COALESCE(patch.{column}, p.{column})" for column in PATCH_COLUMNS)
+_changes = " OR ".join(
+    f"(patch.{column} IS NOT NULL AND patch.{column} IS DISTINCT FROM p.{column})" for column in PATCH_COLUMNS
+)
+
+# Only rows whose values actually change are written; the outer query tells
+# unchanged products from missing ones in the same round trip
+BULK_UPDATE_QUERY = f"""
+    WITH patch AS (
+        SELECT * FROM unnest($1::int[], {_unnest_arrays})
+        AS u(id, {", ".join(PATCH_COLUMNS)})
+    ),
+    updated AS (
+        UPDATE products AS p
+        SET {_assignments}, updated_at = CURRENT_TIMESTAMP
+        FROM patch
+        WHERE p.id = patch.id AND ({_changes})
+        RETURNING p.id
+    )
+    SELECT
+        patch.id,
+        updated.id IS NOT NULL AS updated,
+        EXISTS (SELECT 1 FROM products WHERE products.id = patch.id) AS found
+    FROM patch
+    LEFT JOIN updated ON updated.id = patch.id
+"""
+
+
+def validate_patch(row: Dict) -> Tuple[int, dict]:
+    """(product id, changed columns) for a patch row, or RowError"""
+    unknown = set(row) - {"id", *PATCH_COLUMNS}
+    if unknown:
+        raise RowError(f"Unknown fields: {', '.join(sorted(unknown))}")
+    product_id = row.get("id")
+    if not isinstance(product_id, int) or isinstance(product_id, bool) or product_id <= 0:
+        raise RowError("id must be a positive integer")
+
+    changes = {}
+    for column in ("name", "description", "category", "image_url"):
+        value = row.get(column)
+        if value is None:
+            continue
+        if not isinstance(value, str):
+            raise RowError(f"{column} must be a string")
+        limit = MAX_LENGTHS.get(column)
+        if limit is not None and len(value) > limit:
+            raise RowError(f"{column} is longer than {limit} characters")
+        if column == "name" and not value.strip():
+            raise RowError("name must not be empty")
+        changes[column] = value
+
+    price = row.get("price")
+    if price is not None:
+        if isinstance(price, bool):
+            raise RowError("price must be a number")
+        try:
+            price = Decimal(str(price).strip())
+        except InvalidOperation:
+            raise RowError("price must be a number")
+        if not price.is_finite() or price < 0 or price > MAX_PRICE:
+            raise RowError("price is out of range")
+        changes["price"] = price.quantize(Decimal("0.01"))
+
+    stock = row.get("stock_quantity")
+    if stock is not None:
+        if not isinstance(stock, int) or isinstance(stock, bool):
+            raise RowError("stock_quantity must be an integer")
+        if stock < 0:
+            raise RowError("stock_quantity must not be negative")
+        changes["stock_quantity"] = stock
+
+    if not changes:
+        raise RowError("No fields to update")
+    return product_id, changes
+
+
+async def apply_patches(
+    conn,
+    rows: AsyncIterator[Tuple[int, dict]],
+    chunk_size: int,
+    max_reported_errors: int,
+    on_chunk: Callable[[object, List[int]], Awaitable[None]]
+) -> dict:
+    """
+    Validate patches as they arrive and apply them a chunk of products at a
+    time, reporting the outcome for every product id
+
+    Patches for a product still waiting in the current chunk are merged,
+    later fields winning. Each chunk commits on its own, so a failed chunk
+    does not undo the ones before it; on_chunk runs inside the chunk's
+    transaction with the ids that changed.
+    """
+    report = {
+        "received": 0,
+        "updated": [],
+        "unchanged": [],
+        "not_found": [],
+        "failed": [],
+        "error_count": 0,
+        "errors": [],
+        "errors_truncated": False,
+    }
+    pending: Dict[int, dict] = {}
+
+    async def flush():
+        ids = sorted(pending)
+        columns = [[pending[product_id].get(column) for product_id in ids] for column in PATCH_COLUMNS]
+        pending.clear()
+        try:
+            async with conn.transaction():
+                outcomes = await conn.fetch(BULK_UPDATE_QUERY, ids, *columns)
+                changed = [outcome["id"] for outcome in outcomes if outcome["updated"]]
+                if changed:
+                    await on_chunk(conn, changed)
+        except Exception as e:
+            report["failed"].extend({"id": product_id, "error": str(e)} for product_id in ids)
+            return
+        for outcome in outcomes:
+            if outcome["updated"]:
+                report["updated"].append(outcome["id"])
+            elif outcome["found"]:
+                report["unchanged"].append(outcome["id"])
+            else:
+                report["not_found"].append(outcome["id"])
+
+    async for line_number, row in rows:
+        report["received"] += 1
+        try:
+            if isinstance(row, RowError):
+                raise row
+            product_id, changes = validate_patch(row)
+        except RowError as e:
+            report["error_count"] += 1
+            if len(report["errors"]) < max_reported_errors:
+                report["errors"].append({"line": line_number, "error": str(e)})
+            continue
+        pending.setdefault(product_id, {}).update(changes)
+        if len(pending) >= chunk_size:
+            await flush()
+    if pending:
+        await flush()
+
+    report["errors_truncated"] = report["error_count"] > len(report["errors"])
+    return report
@@ -0,0 +1,222 @@
+"""
+Bulk catalog import for the Product Service
+Streamed CSV or NDJSON rows are validated as they arrive, copied into a
+staging table in batches and merged into products by SKU
+"""
+
+import codecs
+import csv
+import json
+from decimal import Decimal, InvalidOperation
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+# Columns a feed may provide; sku, name and price are required
+IMPORT_COLUMNS = ("sku", "name", "description", "price", "category", "image_url", "stock_quantity")
+REQUIRED_COLUMNS = ("sku", "name", "price")
+MAX_LENGTHS = {"sku": 100, "name": 255, "category": 100, "image_url": 500}
+MAX_PRICE = Decimal("99999999.99")
+
+STAGING_TABLE = "product_import"
+
+
+class RowError(Exception):
+    """A feed row that cannot be imported"""
+
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """Decode a byte stream into lines without holding more than one chunk"""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pending = ""
+    async for chunk in chunks:
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            yield line
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending
+
+
+async def iter_csv(chunks: AsyncIterator[bytes]) -> AsyncIterator[Tuple[int, dict]]:
+    """(line number, row) pairs from CSV with a header row"""
+    header: Optional[List[str]] = None
+    record = ""
+    line_number = start = 0
+    async for line in iter_lines(chunks):
+        line_number += 1
+        if not record:
+            start = line_number
+        record += line + "\n"
+        # A quoted field may span lines; the record ends once quotes balance
+        if record.count('"') % 2:
+            continue
+        values = next(csv.reader([record]), [])
+        record = ""
+        if not values or values == [""]:
+            continue
+        if header is None:
+            header = [value.strip().lower() for value in values]
+            unknown = set(header) - set(IMPORT_COLUMNS)
+            if unknown:
+                raise ValueError(f"Unknown columns: {', '.join(sorted(unknown))}")
+            missing = set(REQUIRED_COLUMNS) - set(header)
+            if missing:
+                raise ValueError(f"Missing columns: {', '.join(sorted(missing))}")
+            continue
+        if len(values) != len(header):
+            yield start, RowError(f"Expected {len(header)} values, got {len(values)}")
+            continue
+        yield start, dict(zip(header, values))
+    if record:
+        yield start, RowError("Unterminated quoted field")
+
+
+async def iter_ndjson(chunks: AsyncIterator[bytes]) -> AsyncIterator[Tuple[int, dict]]:
+    """(line number, row) pairs from newline-delimited JSON objects"""
+    line_number = 0
+    async for line in iter_lines(chunks):
+        line_number += 1
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield line_number, RowError(f"Invalid JSON: {e}")
+            continue
+        if not isinstance(row, dict):
+            yield line_number, RowError("Expected a JSON object")
+            continue
+        yield line_number, row
+
+
+def blank(value) -> bool:
+    return value is None or (isinstance(value, str) and not value.strip())
+
+
+def validate_row(line_number: int, row: Dict) -> tuple:
+    """Staging-table record for a feed row, or RowError"""
+    unknown = set(row) - set(IMPORT_COLUMNS)
+    if unknown:
+        raise RowError(f"Unknown fields: {', '.join(sorted(unknown))}")
+    for column in REQUIRED_COLUMNS:
+        if blank(row.get(column)):
+            raise RowError(f"{column} is required")
+
+    text = {}
+    for column in ("sku", "name", "description", "category", "image_url"):
+        value = row.get(column)
+        value = None if blank(value) else str(value).strip()
+        limit = MAX_LENGTHS.get(column)
+        if value is not None and limit is not None and len(value) > limit:
+            raise RowError(f"{column} is longer than {limit} characters")
+        text[column] = value
+
+    try:
+        price = Decimal(str(row["price"]).strip())
+    except InvalidOperation:
+        raise RowError("price must be a number")
+    if not price.is_finite() or price < 0 or price > MAX_PRICE:
+        raise RowError("price is out of range")
+
+    stock = row.get("stock_quantity")
+    if blank(stock):
+        stock = 0
+    else:
+        try:
+            stock = int(str(stock).strip())
+        except ValueError:
+            raise RowError("stock_quantity must be an integer")
+        if stock < 0:
+            raise RowError("stock_quantity must not be negative")
+
+    return (
+        line_number,
+        text["sku"],
+        text["name"],
+        text["description"],
+        price.quantize(Decimal("0.01")),
+        text["category"],
+        text["image_url"],
+        stock,
+    )
+
+
+async def import_products(
+    conn,
+    rows: AsyncIterator[Tuple[int, dict]],
+    batch_size: int,
+    max_reported_errors: int
+) -> dict:
+    """
+    Validate and stage every row, then upsert the staged rows into products
+
+    Must run inside a transaction: the staging table is dropped on commit.
+    When a SKU appears more than once, its last row wins.
+    """
+    await conn.execute(f"""
+        CREATE TEMP TABLE {STAGING_TABLE} (
+            line INTEGER,
+            sku VARCHAR(100),
+            name VARCHAR(255),
+            description TEXT,
+            price DECIMAL(10, 2),
+            category VARCHAR(100),
+            image_url VARCHAR(500),
+            stock_quantity INTEGER
+        ) ON COMMIT DROP
+    """)
+    columns = ["line", *IMPORT_COLUMNS]
+
+    received = staged = error_count = 0
+    errors = []
+    batch = []
+    async for line_number, row in rows:
+        received += 1
+        try:
+            if isinstance(row, RowError):
+                raise row
+            batch.append(validate_row(line_number, row))
+        except RowError as e:
+            error_count += 1
+            if len(errors) < max_reported_errors:
+                errors.append({"line": line_number, "error": str(e)})
+            continue
+        if len(batch) >= batch_size:
+            await conn.copy_records_to_table(STAGING_TABLE, records=batch, columns=columns)
+            staged += len(batch)
+            batch = []
+    if batch:
+        await conn.copy_records_to_table(STAGING_TABLE, records=batch, columns=columns)
+        staged += len(batch)
+
+    merged = await conn.fetchrow(f"""
+        WITH merged AS (
+            INSERT INTO products (sku, name, description, price, category, image_url, stock_quantity)
+            SELECT DISTINCT ON (sku) sku, name, description, price, category, image_url, stock_quantity
+            FROM {STAGING_TABLE}
+            ORDER BY sku, line DESC
+            ON CONFLICT (sku) DO UPDATE SET
+                name = EXCLUDED.name,
+                description = EXCLUDED.description,
+                price = EXCLUDED.price,
+                category = EXCLUDED.category,
+                image_url = EXCLUDED.image_url,
+                stock_quantity = EXCLUDED.stock_quantity,
+                updated_at = CURRENT_TIMESTAMP
+            RETURNING (xmax = 0) AS inserted
+        )
+        SELECT
+            count(*) FILTER (WHERE inserted) AS inserted,
+            count(*) FILTER (WHERE NOT inserted) AS updated
+        FROM merged
+    """)
+
+    return {
+        "received": received,
+        "staged": staged,
+        "inserted": merged["inserted"],
+        "updated": merged["updated"],
+        "error_count": error_count,
+        "errors": errors,
+        "errors_truncated": error_count > len(errors),
+    }
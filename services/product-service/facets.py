@@ -0,0 +1,186 @@
+"""
+Catalog facets for the Product Service
+Product counts per (category, price bucket) are kept in an aggregate table
+maintained by statement-level triggers on products, so facet requests read
+a handful of rows instead of scanning the catalog
+"""
+
+from decimal import Decimal, InvalidOperation
+from typing import Dict, Iterable, Optional, Tuple
+
+FACET_TABLE = "product_facet_counts"
+
+# Lower bounds of the price buckets; the last bucket is open-ended
+DEFAULT_PRICE_BOUNDS = "0,10,25,50,100,250,500,1000"
+
+
+def parse_price_bounds(value: str) -> Tuple[Decimal, ...]:
+    """Strictly increasing bucket bounds from a comma-separated list"""
+    try:
+        bounds = tuple(Decimal(item.strip()) for item in value.split(",") if item.strip())
+    except InvalidOperation:
+        raise ValueError(f"Invalid price bucket bounds: {value!r}")
+    if not bounds or any(not b.is_finite() for b in bounds):
+        raise ValueError(f"Invalid price bucket bounds: {value!r}")
+    if any(low >= high for low, high in zip(bounds, bounds[1:])):
+        raise ValueError("Price bucket bounds must be strictly increasing")
+    return bounds
+
+
+def bounds_literal(bounds: Iterable[Decimal]) -> str:
+    return "ARRAY[" + ", ".join(str(b) for b in bounds) + "]::numeric[]"
+
+
+async def install_facets(conn, bounds: Tuple[Decimal, ...]):
+    """
+    Create the aggregate table and its triggers, rebuilding the counts when
+    the table is new or the bucket bounds changed
+
+    Writers are locked out while this runs so no change is counted twice
+    or missed; readers are not blocked.
+    """
+    async with conn.transaction():
+        await conn.execute("LOCK TABLE products IN SHARE ROW EXCLUSIVE MODE")
+        await conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS {FACET_TABLE} (
+                category VARCHAR(100),
+                bucket INTEGER NOT NULL,
+                product_count BIGINT NOT NULL,
+                UNIQUE NULLS NOT DISTINCT (category, bucket)
+            )
+        """)
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS product_facet_config (
+                id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+                price_bounds NUMERIC[] NOT NULL
+            )
+        """)
+        stored = await conn.fetchval("SELECT price_bounds FROM product_facet_config")
+
+        # width_bucket: 0 below the first bound, otherwise the number of bounds <= price
+        await conn.execute(f"""
+            CREATE OR REPLACE FUNCTION facet_price_bucket(price NUMERIC) RETURNS INTEGER AS $$
+                SELECT width_bucket(price, {bounds_literal(bounds)})
+            $$ LANGUAGE sql IMMUTABLE
+        """)
+        # Net change per (category, bucket) of one statement, applied in key
+        # order so concurrent writers lock aggregate rows in the same order
+        await conn.execute(f"""
+            CREATE OR REPLACE FUNCTION product_facets_apply() RETURNS trigger AS $$
+            BEGIN
+                IF TG_OP = 'TRUNCATE' THEN
+                    DELETE FROM {FACET_TABLE};
+                    RETURN NULL;
+                END IF;
+                IF TG_OP = 'INSERT' THEN
+                    INSERT INTO {FACET_TABLE} (category, bucket, product_count)
+                    SELECT category, facet_price_bucket(price), count(*)
+                    FROM new_rows
+                    GROUP BY 1, 2
+                    ORDER BY 1, 2
+                    ON CONFLICT (category, bucket) DO UPDATE
+                    SET product_count = {FACET_TABLE}.product_count + EXCLUDED.product_count;
+                    RETURN NULL;
+                END IF;
+                IF TG_OP = 'DELETE' THEN
+                    INSERT INTO {FACET_TABLE} (category, bucket, product_count)
+                    SELECT category, facet_price_bucket(price), -count(*)
+                    FROM old_rows
+                    GROUP BY 1, 2
+                    ORDER BY 1, 2
+                    ON CONFLICT (category, bucket) DO UPDATE
+                    SET product_count = {FACET_TABLE}.product_count + EXCLUDED.product_count;
+                ELSE
+                    WITH delta AS (
+                        SELECT category, facet_price_bucket(price) AS bucket, count(*) AS n
+                        FROM new_rows GROUP BY 1, 2
+                        UNION ALL
+                        SELECT category, facet_price_bucket(price), -count(*)
+                        FROM old_rows GROUP BY 1, 2
+                    )
+                    INSERT INTO {FACET_TABLE} (category, bucket, product_count)
+                    SELECT category, bucket, sum(n)
+                    FROM delta
+                    GROUP BY 1, 2
+                    HAVING sum(n) <> 0
+                    ORDER BY 1, 2
+                    ON CONFLICT (category, bucket) DO UPDATE
+                    SET product_count = {FACET_TABLE}.product_count + EXCLUDED.product_count;
+                END IF;
+                DELETE FROM {FACET_TABLE} WHERE product_count = 0;
+                RETURN NULL;
+            END
+            $$ LANGUAGE plpgsql
+        """)
+        # Transition tables need one trigger per event
+        await conn.execute("""
+            CREATE OR REPLACE TRIGGER product_facets_insert
+            AFTER INSERT ON products REFERENCING NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION product_facets_apply()
+        """)
+        await conn.execute("""
+            CREATE OR REPLACE TRIGGER product_facets_update
+            AFTER UPDATE ON products REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION product_facets_apply()
+        """)
+        await conn.execute("""
+            CREATE OR REPLACE TRIGGER product_facets_delete
+            AFTER DELETE ON products REFERENCING OLD TABLE AS old_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION product_facets_apply()
+        """)
+        await conn.execute("""
+            CREATE OR REPLACE TRIGGER product_facets_truncate
+            AFTER TRUNCATE ON products
+            FOR EACH STATEMENT EXECUTE FUNCTION product_facets_apply()
+        """)
+
+        if stored is None or tuple(stored) != bounds:
+            await conn.execute(f"DELETE FROM {FACET_TABLE}")
+            await conn.execute(f"""
+                INSERT INTO {FACET_TABLE} (category, bucket, product_count)
+                SELECT category, facet_price_bucket(price), count(*)
+                FROM products GROUP BY 1, 2
+            """)
+            await conn.execute("""
+                INSERT INTO product_facet_config (id, price_bounds) VALUES (TRUE, $1)
+                ON CONFLICT (id) DO UPDATE SET price_bounds = EXCLUDED.price_bounds
+            """, list(bounds))
+
+
+def summarize(
+    rows: Iterable,
+    category: Optional[str],
+    bounds: Tuple[Decimal, ...]
+) -> dict:
+    """
+    Facets from (category, bucket, product_count) rows
+
+    Category counts ignore the category filter, so every category stays
+    selectable; the price histogram and total apply it.
+    """
+    categories: Dict[Optional[str], int] = {}
+    buckets = [0] * (len(bounds) + 1)
+    for row in rows:
+        categories[row["category"]] = categories.get(row["category"], 0) + row["product_count"]
+        if category is None or row["category"] == category:
+            buckets[row["bucket"]] += row["product_count"]
+
+    price_ranges = []
+    for bucket, count in enumerate(buckets):
+        # Bucket 0 holds prices below the first bound, normally none
+        if bucket == 0 and not count:
+            continue
+        price_ranges.append({
+            "min": float(bounds[bucket - 1]) if bucket > 0 else None,
+            "max": float(bounds[bucket]) if bucket < len(bounds) else None,
+            "count": count,
+        })
+
+    return {
+        "total": sum(buckets),
+        "categories": [
+            {"category": name, "count": count}
+            for name, count in sorted(categories.items(), key=lambda item: (-item[1], item[0] or ""))
+        ],
+        "price_ranges": price_ranges,
+    }
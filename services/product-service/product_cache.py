@@ -0,0 +1,188 @@
+"""
+In-process product cache for the Product Service
+Serialized products are kept in a bounded LRU with a TTL and are
+invalidated across replicas through Postgres LISTEN/NOTIFY
+"""
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Iterable, List, Optional
+
+import asyncpg
+
+logger = logging.getLogger(__name__)
+
+# Channel carrying comma-separated product ids, or "*" for everything
+PRODUCT_CHANNEL = "product_changes"
+
+# NOTIFY payloads must stay under 8000 bytes
+MAX_PAYLOAD_BYTES = 7900
+
+
+def notify_payloads(product_ids: Iterable[int]) -> List[str]:
+    """Comma-separated id lists, each small enough for one NOTIFY"""
+    payloads = []
+    current = ""
+    for product_id in product_ids:
+        item = str(product_id)
+        if current and len(current) + len(item) + 1 > MAX_PAYLOAD_BYTES:
+            payloads.append(current)
+            current = ""
+        current = f"{current},{item}" if current else item
+    if current:
+        payloads.append(current)
+    return payloads
+
+
+async def notify_product_change(conn, product_ids: Optional[Iterable[int]]):
+    """
+    Tell every replica (this one included) that these products changed, or
+    that any product may have when product_ids is None
+    """
+    payloads = ["*"] if product_ids is None else notify_payloads(product_ids)
+    for payload in payloads:
+        await conn.execute("SELECT pg_notify($1, $2)", PRODUCT_CHANNEL, payload)
+
+
+class ProductCache:
+    """
+    Bounded LRU/TTL cache of serialized products keyed by id
+
+    The cache is only trusted while the LISTEN connection is up; when it
+    drops the cache is cleared and bypassed until the listener reconnects,
+    since notifications sent in between are lost. A read that started
+    before an invalidation does not store its (possibly stale) result.
+    """
+
+    def __init__(
+        self,
+        max_entries: int,
+        ttl: float,
+        reconnect_delay: float = 1.0,
+        keepalive: float = 10.0
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.reconnect_delay = reconnect_delay
+        self.keepalive = keepalive
+        self.entries: "OrderedDict[int, tuple]" = OrderedDict()
+        self.epoch = 0
+        self.listening = False
+        self.connection: Optional[asyncpg.Connection] = None
+        self.listener: Optional[asyncio.Task] = None
+        self.lost = asyncio.Event()
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.reconnects = 0
+
+    def get(self, product_id: int) -> Optional[Any]:
+        if not self.listening:
+            self.bypassed += 1
+            return None
+        entry = self.entries.get(product_id)
+        if entry is None or entry[0] < time.monotonic():
+            self.misses += 1
+            return None
+        self.entries.move_to_end(product_id)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, product_id: int, value: Any, epoch: int):
+        """Store a value read while the cache was at `epoch`"""
+        if not self.listening or epoch != self.epoch:
+            return
+        self.entries[product_id] = (time.monotonic() + self.ttl, value)
+        self.entries.move_to_end(product_id)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, product_ids: Optional[Iterable[int]] = None):
+        """Drop the given products, or everything when product_ids is None"""
+        self.epoch += 1
+        self.invalidations += 1
+        if product_ids is None:
+            self.entries.clear()
+            return
+        for product_id in product_ids:
+            self.entries.pop(product_id, None)
+
+    def on_notify(self, connection, pid, channel, payload: str):
+        if payload == "*":
+            self.invalidate()
+            return
+        try:
+            self.invalidate(int(item) for item in payload.split(",") if item)
+        except ValueError:
+            self.invalidate()
+
+    def on_termination(self, connection):
+        logger.warning("Product cache listener disconnected, bypassing cache")
+        self.listening = False
+        self.invalidate()
+        self.lost.set()
+
+    async def listen_loop(self, dsn: str):
+        """Keep a LISTEN connection open, reconnecting when it drops"""
+        while True:
+            try:
+                self.lost.clear()
+                self.connection = await asyncpg.connect(dsn)
+                self.connection.add_termination_listener(self.on_termination)
+                await self.connection.add_listener(PRODUCT_CHANNEL, self.on_notify)
+                # Anything may have changed while nobody was listening
+                self.invalidate()
+                self.listening = True
+                while not self.lost.is_set():
+                    try:
+                        await asyncio.wait_for(self.lost.wait(), self.keepalive)
+                    except asyncio.TimeoutError:
+                        # Catch connections that died without closing
+                        await self.connection.execute("SELECT 1", timeout=self.keepalive)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Product cache listener error: {e}")
+            self.listening = False
+            self.invalidate()
+            if self.connection is not None and not self.connection.is_closed():
+                self.connection.terminate()
+            self.reconnects += 1
+            await asyncio.sleep(self.reconnect_delay)
+
+    def start(self, dsn: str):
+        if self.listener is None:
+            self.listener = asyncio.ensure_future(self.listen_loop(dsn))
+
+    async def stop(self):
+        if self.listener is not None:
+            self.listener.cancel()
+            try:
+                await self.listener
+            except asyncio.CancelledError:
+                pass
+            self.listener = None
+        self.listening = False
+        if self.connection is not None and not self.connection.is_closed():
+            await self.connection.close()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "listening": self.listening,
+            "entries": len(self.entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "bypassed": self.bypassed,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "reconnects": self.reconnects,
+        }
@@ -0,0 +1,77 @@
+"""
+Fast JSON serialization for the Product Service
+Rows are converted by functions generated once per column set and rendered
+straight to bytes with orjson, bypassing FastAPI's jsonable_encoder
+"""
+
+from decimal import Decimal
+from typing import Any, Callable, Dict, FrozenSet, Iterable, Mapping, Optional, Tuple
+
+import orjson
+from fastapi.responses import Response
+
+# Generated serializers by (fields, decimal fields)
+_serializers: Dict[Tuple[Tuple[str, ...], FrozenSet[str]], Callable[[Mapping], dict]] = {}
+
+
+def row_serializer(
+    fields: Iterable[str],
+    decimals: FrozenSet[str] = frozenset()
+) -> Callable[[Mapping], dict]:
+    """
+    Function turning a row into a dict of `fields`
+
+    The function is generated and compiled the first time a field set is
+    seen. Decimal columns become floats; datetimes are left to orjson,
+    which renders them in the same ISO format as isoformat().
+    """
+    key = (tuple(fields), frozenset(decimals))
+    serializer = _serializers.get(key)
+    if serializer is not None:
+        return serializer
+
+    items = []
+    for field in key[0]:
+        if not field.isidentifier():
+            raise ValueError(f"Invalid field name: {field!r}")
+        if field in key[1]:
+            items.append(f"{field!r}: None if (v := row[{field!r}]) is None else float(v)")
+        else:
+            items.append(f"{field!r}: row[{field!r}]")
+    source = "def serialize(row):\n    return {" + ", ".join(items) + "}\n"
+    namespace: Dict[str, Any] = {}
+    exec(compile(source, f"<serializer {','.join(key[0])}>", "exec"), namespace)
+    serializer = namespace["serialize"]
+    _serializers[key] = serializer
+    return serializer
+
+
+def _default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+def dumps(content: Any, newline: bool = False) -> bytes:
+    """Serialize to JSON bytes, optionally newline-terminated for NDJSON"""
+    option = orjson.OPT_APPEND_NEWLINE if newline else 0
+    return orjson.dumps(content, default=_default, option=option)
+
+
+def raw_json(text: str):
+    """Embed an already-encoded JSON document (e.g. a json_agg column) as is"""
+    return orjson.Fragment(text)
+
+
+def json_response(
+    content: Any,
+    status_code: int = 200,
+    headers: Optional[Dict[str, str]] = None
+) -> Response:
+    """JSON response rendered with orjson"""
+    return Response(
+        content=dumps(content),
+        status_code=status_code,
+        headers=headers,
+        media_type="application/json"
+    )
@@ -0,0 +1,115 @@
+import asyncio
+from decimal import Decimal
+
+import pytest
+
+from catalog_import import RowError, iter_csv, iter_lines, iter_ndjson, validate_row
+
+
+async def stream(*chunks):
+    for chunk in chunks:
+        yield chunk
+
+
+def collect(rows):
+    async def gather():
+        return [row async for row in rows]
+    return asyncio.run(gather())
+
+
+def parsed(rows):
+    """Rows as (line, row) with errors reduced to their message"""
+    return [
+        (line, f"error: {row}" if isinstance(row, RowError) else row)
+        for line, row in collect(rows)
+    ]
+
+
+def test_lines_split_across_chunks():
+    assert collect(iter_lines(stream(b"ab", b"c\nde", b"f\n", b"g"))) == ["abc", "def", "g"]
+
+
+def test_lines_decode_multibyte_split_across_chunks():
+    text = "café\n".encode()
+    assert collect(iter_lines(stream(text[:4], text[4:]))) == ["café"]
+
+
+def test_lines_strip_byte_order_mark():
+    assert collect(iter_lines(stream(b"\xef\xbb\xbfsku\n"))) == ["sku"]
+
+
+def test_csv_rows_keyed_by_header():
+    rows = parsed(iter_csv(stream(
+        b"SKU,Name,Price\n",
+        b"a-1,Lamp,9.50\n\nb-2,Desk,120\n"
+    )))
+    assert rows == [
+        (2, {"sku": "a-1", "name": "Lamp", "price": "9.50"}),
+        (4, {"sku": "b-2", "name": "Desk", "price": "120"}),
+    ]
+
+
+def test_csv_quoted_field_spans_lines_and_chunks():
+    rows = parsed(iter_csv(stream(
+        b'sku,name,price,description\na-1,Lamp,9.50,"Warm',
+        b' light\nwith ""dimmer"""\nb-2,Desk,120,\n'
+    )))
+    assert rows == [
+        (2, {"sku": "a-1", "name": "Lamp", "price": "9.50", "description": 'Warm light\nwith "dimmer"'}),
+        (4, {"sku": "b-2", "name": "Desk", "price": "120", "description": ""}),
+    ]
+
+
+def test_csv_wrong_value_count_is_a_row_error():
+    rows = parsed(iter_csv(stream(b"sku,name,price\na-1,Lamp\nb-2,Desk,120\n")))
+    assert rows == [
+        (2, "error: Expected 3 values, got 2"),
+        (3, {"sku": "b-2", "name": "Desk", "price": "120"}),
+    ]
+
+
+def test_csv_unterminated_quote_is_a_row_error():
+    rows = parsed(iter_csv(stream(b'sku,name,price\na-1,"Lamp,9.50\n')))
+    assert rows == [(2, "error: Unterminated quoted field")]
+
+
+def test_csv_header_must_name_known_and_required_columns():
+    with pytest.raises(ValueError, match="Unknown columns: colour"):
+        collect(iter_csv(stream(b"sku,name,price,colour\n")))
+    with pytest.raises(ValueError, match="Missing columns: price"):
+        collect(iter_csv(stream(b"sku,name\n")))
+
+
+def test_ndjson_rows_and_errors_keep_line_numbers():
+    rows = parsed(iter_ndjson(stream(
+        b'{"sku": "a-1", "name": "Lamp", "price": 9.5}\n\n',
+        b'{"sku": \n[1, 2]\n{"sku": "b-2"}'
+    )))
+    assert rows[0] == (1, {"sku": "a-1", "name": "Lamp", "price": 9.5})
+    assert rows[1][0] == 3 and rows[1][1].startswith("error: Invalid JSON")
+    assert rows[2] == (4, "error: Expected a JSON object")
+    assert rows[3] == (5, {"sku": "b-2"})
+
+
+def test_validate_row_normalizes_values():
+    record = validate_row(7, {
+        "sku": " a-1 ", "name": "Lamp", "price": "9.5", "description": "  ",
+        "stock_quantity": " 3 "
+    })
+    assert record == (7, "a-1", "Lamp", None, Decimal("9.50"), None, None, 3)
+    assert validate_row(1, {"sku": "a", "name": "b", "price": 1})[-1] == 0
+
+
+@pytest.mark.parametrize("row, message", [
+    ({"sku": "a", "name": "b"}, "price is required"),
+    ({"sku": "a", "name": "b", "price": "cheap"}, "price must be a number"),
+    ({"sku": "a", "name": "b", "price": "-1"}, "price is out of range"),
+    ({"sku": "a", "name": "b", "price": "NaN"}, "price is out of range"),
+    ({"sku": "a", "name": "b", "price": 1, "stock_quantity": "1.5"}, "stock_quantity must be an integer"),
+    ({"sku": "a", "name": "b", "price": 1, "stock_quantity": -1}, "stock_quantity must not be negative"),
+    ({"sku": "a" * 101, "name": "b", "price": 1}, "sku is longer than 100 characters"),
+    ({"sku": "a", "name": "b", "price": 1, "colour": "red"}, "Unknown fields: colour"),
+])
+def test_validate_row_rejects(row, message):
+    with pytest.raises(RowError, match=message):
+        validate_row(1, row)
@@ -0,0 +1,36 @@
+"""
+Gateway identity for the User Service
+The API gateway verifies bearer tokens once and forwards the caller's
+identity as HMAC-signed headers; this module is copied into each service
+that trusts them, as every image builds from its own directory
+"""
+
+import hashlib
+import hmac
+import time
+from typing import Optional
+
+
+def verify_gateway_identity(headers, secret: str) -> Optional[dict]:
+    """Read the caller's identity from headers signed by the API gateway"""
+    user_id = headers.get("x-user-id")
+    email = headers.get("x-user-email")
+    expires = headers.get("x-user-expires")
+    signature = headers.get("x-identity-signature")
+    if not (user_id and email is not None and expires and signature):
+        return None
+
+    expected = hmac.new(
+        secret.encode(),
+        f"{user_id}|{email}|{expires}".encode(),
+        hashlib.sha256
+    ).hexdigest()
+    if not hmac.compare_digest(expected, signature):
+        return None
+
+    try:
+        if int(expires) <= time.time():
+            return None
+        return {"userId": int(user_id), "email": email, "exp": int(expires)}
+    except ValueError:
+        return None